@@ -0,0 +1,156 @@
+# answer_cache.py
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from psycopg.types.json import Jsonb
+
+import db
+
+# --- Cache Configuration ---
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get("ANSWER_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+ANSWER_CACHE_LRU_SIZE = int(os.environ.get("ANSWER_CACHE_LRU_SIZE", "2048"))
+# Bounds how stale this process's LRU can be after another worker invalidates a document
+ANSWER_CACHE_LRU_TTL_SECONDS = int(os.environ.get("ANSWER_CACHE_LRU_TTL_SECONDS", "300"))
+# Semantic hits: reuse an answer whose question embedding is this similar (cosine)
+ANSWER_CACHE_SEMANTIC = os.environ.get("ANSWER_CACHE_SEMANTIC", "0") == "1"
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.environ.get("ANSWER_CACHE_SEMANTIC_THRESHOLD", "0.95"))
+ANSWER_CACHE_SEMANTIC_CANDIDATES = int(os.environ.get("ANSWER_CACHE_SEMANTIC_CANDIDATES", "500"))
+
+
+def normalize_question(question: str) -> str:
+    """Canonical form of a question: case, whitespace and trailing punctuation are ignored."""
+    return re.sub(r"\s+", " ", question).strip().rstrip("?.! ").lower()
+
+
+class AnswerCache:
+    """
+    Answers keyed on (document content hash, normalized question).
+    Postgres is the shared store; a small in-process LRU sits in front of it.
+    """
+
+    def __init__(self, lru_size: int = ANSWER_CACHE_LRU_SIZE, ttl_seconds: int = ANSWER_CACHE_TTL_SECONDS,
+                 semantic: bool = ANSWER_CACHE_SEMANTIC):
+        self.lru_size = lru_size
+        self.ttl_seconds = ttl_seconds
+        self.semantic = semantic
+        self._lru: OrderedDict[tuple[str, str], tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def setup(conn):
+        """Creates the cache table on a connection from setup_database()."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                content_hash TEXT NOT NULL,
+                question_key TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                context_ids JSONB,
+                question_embedding REAL[],
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+                PRIMARY KEY (content_hash, question_key)
+            );
+        """)
+
+    # --- In-process LRU ---
+
+    def _lru_get(self, key: tuple[str, str]) -> str | None:
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                return None
+            answer, expires = entry
+            if expires < time.monotonic():
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            return answer
+
+    def _lru_put(self, key: tuple[str, str], answer: str):
+        with self._lock:
+            self._lru[key] = (answer, time.monotonic() + min(self.ttl_seconds, ANSWER_CACHE_LRU_TTL_SECONDS))
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    # --- Lookups ---
+
+    def get_many(self, content_hash: str, questions: list[str]) -> list[str | None]:
+        """Returns the cached answer for each question, or None on a miss."""
+        keys = [normalize_question(question) for question in questions]
+        answers = [self._lru_get((content_hash, key)) for key in keys]
+
+        missing = sorted({key for key, answer in zip(keys, answers) if answer is None})
+        if missing:
+            with db.connection() as conn:
+                rows = conn.execute("""
+                    SELECT question_key, answer FROM answer_cache
+                    WHERE content_hash = %s AND question_key = ANY(%s) AND expires_at > NOW();
+                """, (content_hash, missing)).fetchall()
+            found = dict(rows)
+            for key, answer in found.items():
+                self._lru_put((content_hash, key), answer)
+            answers = [found.get(key) if answer is None else answer for key, answer in zip(keys, answers)]
+        return answers
+
+    def get_similar(self, content_hash: str, question_vectors: list) -> list[str | None]:
+        """
+        Semantic lookup: for each question embedding, returns the answer of the most
+        similar cached question if it is within the similarity threshold.
+        """
+        if not self.semantic or not question_vectors:
+            return [None] * len(question_vectors)
+        with db.connection() as conn:
+            rows = conn.execute("""
+                SELECT answer, question_embedding FROM answer_cache
+                WHERE content_hash = %s AND question_embedding IS NOT NULL AND expires_at > NOW()
+                ORDER BY created_at DESC LIMIT %s;
+            """, (content_hash, ANSWER_CACHE_SEMANTIC_CANDIDATES)).fetchall()
+        if not rows:
+            return [None] * len(question_vectors)
+
+        cached = _normalize_rows(np.array([row[1] for row in rows], dtype=np.float32))
+        queries = _normalize_rows(np.asarray(question_vectors, dtype=np.float32))
+        similarities = queries @ cached.T
+        best = similarities.argmax(axis=1)
+        return [
+            rows[j][0] if similarities[i, j] >= ANSWER_CACHE_SEMANTIC_THRESHOLD else None
+            for i, j in enumerate(best)
+        ]
+
+    # --- Updates ---
+
+    def put(self, content_hash: str, question: str, answer: str,
+            context_ids: list | None = None, question_vector=None):
+        """Stores an answer with the IDs of the chunks it was generated from."""
+        key = normalize_question(question)
+        vector = None if question_vector is None else [float(x) for x in question_vector]
+        with db.connection() as conn:
+            conn.execute("""
+                INSERT INTO answer_cache
+                    (content_hash, question_key, question, answer, context_ids, question_embedding, expires_at)
+                VALUES (%s, %s, %s, %s, %s, %s, NOW() + %s * INTERVAL '1 second')
+                ON CONFLICT (content_hash, question_key) DO UPDATE
+                    SET question = EXCLUDED.question, answer = EXCLUDED.answer,
+                        context_ids = EXCLUDED.context_ids, question_embedding = EXCLUDED.question_embedding,
+                        created_at = NOW(), expires_at = EXCLUDED.expires_at;
+            """, (content_hash, key, question, answer, Jsonb(context_ids or []), vector, self.ttl_seconds))
+        self._lru_put((content_hash, key), answer)
+
+    def invalidate(self, content_hash: str):
+        """Drops every cached answer for a document, e.g. after it has been re-indexed."""
+        with self._lock:
+            for key in [key for key in self._lru if key[0] == content_hash]:
+                del self._lru[key]
+        with db.connection() as conn:
+            conn.execute("DELETE FROM answer_cache WHERE content_hash = %s;", (content_hash,))
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
@@ -0,0 +1,97 @@
+# answer_grouping.py
+import os
+import json
+
+from langchain_core.prompts import PromptTemplate
+
+# --- Grouping Configuration ---
+# Questions whose retrieved chunks overlap are answered by one JSON-mode LLM call
+ANSWER_GROUPING = os.environ.get("ANSWER_GROUPING", "1") == "1"
+GROUP_MIN_OVERLAP = float(os.environ.get("GROUP_MIN_OVERLAP", "0.5"))  # Share of a question's chunks already in the group
+GROUP_MAX_QUESTIONS = int(os.environ.get("GROUP_MAX_QUESTIONS", "6"))
+GROUP_CONTEXT_TOKEN_BUDGET = int(os.environ.get("GROUP_CONTEXT_TOKEN_BUDGET", "2000"))
+
+# Same instructions as ANSWER_PROMPT in processor.py, asking for one JSON answer per numbered question
+GROUPED_ANSWER_PROMPT = PromptTemplate.from_template(
+    """You are an expert at finding answers in a document.
+    Answer each of the following questions based ONLY on the provided context.
+    If the answer is not in the context, state that the answer could not be found.
+    Be concise and extract the answer directly from the text.
+    Respond with a JSON object of the form {{"answers": [{{"id": 1, "answer": "..."}}]}},
+    with one entry for each numbered question.
+
+    Context: {context}
+    Questions:
+    {questions}
+    Answers: """
+)
+
+
+def chunk_id(doc):
+    """Identifies a retrieved chunk within its document: its vector ID, position or text."""
+    for key in ("chunk_id", "chunk_index"):
+        if doc.metadata.get(key) is not None:
+            return doc.metadata[key]
+    return doc.page_content
+
+
+def group_questions(retrieved: dict[int, list], min_overlap: float = GROUP_MIN_OVERLAP,
+                    max_size: int = GROUP_MAX_QUESTIONS) -> list[list[int]]:
+    """
+    Greedily groups question indexes by the chunks retrieved for them.
+    A question joins the first group that already holds at least `min_overlap` of
+    its chunks and has room left; otherwise it starts a new group.
+    """
+    groups: list[tuple[list[int], set]] = []
+    for index, docs in retrieved.items():
+        ids = {chunk_id(doc) for doc in docs}
+        for members, group_ids in groups:
+            if len(members) < max_size and ids and len(ids & group_ids) / len(ids) >= min_overlap:
+                members.append(index)
+                group_ids |= ids
+                break
+        else:
+            groups.append(([index], set(ids)))
+    return [members for members, _ids in groups]
+
+
+def union_docs(doc_lists: list[list]) -> list:
+    """Merges the retrieval results of a group, best-ranked first, without duplicates."""
+    merged, seen = [], set()
+    for rank in range(max((len(docs) for docs in doc_lists), default=0)):
+        for docs in doc_lists:
+            if rank < len(docs) and chunk_id(docs[rank]) not in seen:
+                seen.add(chunk_id(docs[rank]))
+                merged.append(docs[rank])
+    return merged
+
+
+def format_questions(questions: list[str]) -> str:
+    return "\n".join(f"{number}. {question}" for number, question in enumerate(questions, start=1))
+
+
+def parse_grouped_answers(raw: str, count: int) -> dict[int, str]:
+    """
+    Extracts the answers from a grouped response, keyed by question number (1-based).
+    Malformed, missing or empty entries are left out, so their questions can be retried alone.
+    """
+    try:
+        data = json.loads(raw)
+    except (TypeError, ValueError):
+        return {}
+    items = data.get("answers") if isinstance(data, dict) else data
+    if isinstance(items, dict):  # {"1": "...", "2": "..."}
+        items = [{"id": key, "answer": value} for key, value in items.items()]
+    if not isinstance(items, list):
+        return {}
+
+    answers = {}
+    for position, item in enumerate(items, start=1):
+        number, answer = (item.get("id", position), item.get("answer")) if isinstance(item, dict) else (position, item)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            continue
+        if 1 <= number <= count and isinstance(answer, str) and answer.strip():
+            answers.setdefault(number, answer.strip())
+    return answers
@@ -0,0 +1,424 @@
+# benchmark.py
+"""
+Offline, stage-level benchmark of the document Q&A and claim pipelines.
+
+Runs the real PyMuPDF extraction, text splitter and MiniLM embeddings over the
+PDFs in source_documents/, with deterministic local stand-ins for Ollama,
+Pinecone/Milvus (LocalStore in a temporary directory) and Postgres (in memory).
+Results are written as JSON so that runs can be compared:
+
+    python benchmark.py --output bench_output.json
+    python benchmark.py --output new.json --compare bench_output.json
+"""
+import os
+import sys
+import re
+import json
+import time
+import argparse
+import hashlib
+import tempfile
+import platform
+import traceback
+import threading
+import functools
+import http.server
+from contextlib import contextmanager
+
+import numpy as np
+
+SOURCE_DOCS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "source_documents")
+
+SAMPLE_QUESTIONS = [
+    "What is the grace period for premium payment?",
+    "What is the waiting period for pre-existing diseases?",
+    "Does the policy cover maternity expenses?",
+    "What is the waiting period for cataract surgery?",
+    "Are medical expenses for an organ donor covered?",
+    "What is the No Claim Discount offered?",
+    "Is there a benefit for preventive health check-ups?",
+    "How does the policy define a Hospital?",
+    "What is the extent of coverage for AYUSH treatments?",
+    "Are there sub-limits on room rent and ICU charges?",
+]
+
+SAMPLE_CLAIMS = [
+    "46-year-old male, knee surgery in Pune, 3-month-old insurance policy",
+    "My son, who is 19, needs dental braces. Our family policy is 2 years old. Is this covered?",
+    "Cataract surgery for a 61-year-old woman, policy active for 3 years",
+]
+
+
+# --- Measurement ---
+
+class StageTimer:
+    """Collects latency samples and processed item counts per stage."""
+
+    def __init__(self):
+        self.samples: dict[str, list[float]] = {}
+        self.items: dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str, items: int = 1):
+        start = time.perf_counter()
+        yield
+        self.record(name, time.perf_counter() - start, items)
+
+    def record(self, name: str, seconds: float, items: int = 1):
+        self.samples.setdefault(name, []).append(seconds)
+        self.items[name] = self.items.get(name, 0) + items
+
+    def summary(self) -> dict:
+        result = {}
+        for name, samples in self.samples.items():
+            seconds = np.array(samples)
+            total = float(seconds.sum())
+            result[name] = {
+                "calls": len(samples),
+                "items": self.items[name],
+                "total_seconds": round(total, 6),
+                "items_per_second": round(self.items[name] / total, 3) if total > 0 else None,
+                "p50_ms": round(float(np.percentile(seconds, 50)) * 1000, 3),
+                "p90_ms": round(float(np.percentile(seconds, 90)) * 1000, 3),
+                "p99_ms": round(float(np.percentile(seconds, 99)) * 1000, 3),
+            }
+        return result
+
+
+# --- Local Stand-ins ---
+
+class HashEmbeddings:
+    """Deterministic pseudo-embeddings for machines without the MiniLM weights."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dim)
+            vectors.append((vector / np.linalg.norm(vector)).tolist())
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def make_stub_llm(latency_seconds: float, json_mode: bool = False):
+    """
+    Ollama stand-in: answers with the first line of the context after a fixed delay.
+    In JSON mode it answers every numbered question of a grouped prompt.
+    """
+    from langchain_core.language_models.llms import LLM
+
+    class StubLLM(LLM):
+        @property
+        def _llm_type(self) -> str:
+            return "stub"
+
+        def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+            time.sleep(latency_seconds)
+            context = prompt.split("Context:", 1)[-1].strip()
+            answer = context.splitlines()[0][:200] if context else "The answer could not be found."
+            if not json_mode:
+                return answer
+            questions = re.findall(r"^\s*(\d+)\. ", prompt.split("Questions:", 1)[-1], flags=re.MULTILINE)
+            return json.dumps({"answers": [{"id": int(number), "answer": answer} for number in questions]})
+
+    return StubLLM()
+
+
+def make_stub_chat_llm(latency_seconds: float):
+    """ChatOllama stand-in for the claim pipeline: always returns the same valid JSON decision."""
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    decision = json.dumps({"decision": "Approved", "amount": 0, "justification": "Stub decision."})
+    return FakeListChatModel(responses=[decision], sleep=latency_seconds)
+
+
+class MemoryTracking:
+    """In-memory replacement for the Postgres document tracking functions in processor.py."""
+
+    def __init__(self):
+        self.aliases = {}
+        self.status = {}
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    def install(self, processor):
+        processor.get_document_alias = self.aliases.get
+        processor.save_document_alias = lambda url_key, url, fetched: self.aliases.__setitem__(url_key, {
+            "content_hash": fetched.content_hash, "etag": fetched.etag,
+            "last_modified": fetched.last_modified, "content_length": fetched.content_length,
+        })
+        processor.get_document_status = self.status.get
+        processor.claim_document = self.claim
+        processor._set_document_status = self.status.__setitem__
+        processor.mark_document_as_processed = lambda content_hash, namespace, indexed: \
+            self.status.__setitem__(content_hash, "ready")
+        # Every document is new: no earlier version to re-index incrementally
+        processor.get_document_pages = lambda content_hash: {}
+        processor.supersede_document = lambda content_hash: None
+        processor.is_namespace_in_use = lambda namespace, content_hash: False
+        processor.save_document_pages = lambda content_hash, indexed, replaces=None: \
+            self.pages.__setitem__(content_hash, indexed.page_hashes)
+        processor.forget_document_pages = lambda content_hash: self.pages.pop(content_hash, None)
+
+        async def fresh_hash(url_key):
+            return None  # Always revalidate, as an expired alias would
+
+        async def touch(content_hash):
+            return content_hash if self.status.get(content_hash) == "ready" else None
+
+        processor.aget_fresh_document_hash = fresh_hash
+        processor.atouch_document = touch
+
+    def claim(self, content_hash, document_url, tenant=None):
+        with self.lock:
+            if self.status.get(content_hash) in (None, "failed"):
+                self.status[content_hash] = "pending"
+                return True
+            return False
+
+
+class MemoryAnswerCache:
+    """In-memory replacement for answer_cache.AnswerCache."""
+
+    semantic = False
+
+    def __init__(self):
+        self.answers = {}
+
+    def get_many(self, content_hash, questions):
+        from answer_cache import normalize_question
+        return [self.answers.get((content_hash, normalize_question(q))) for q in questions]
+
+    def get_similar(self, content_hash, vectors):
+        return [None] * len(vectors)
+
+    def put(self, content_hash, question, answer, context_ids=None, question_vector=None):
+        from answer_cache import normalize_question
+        self.answers[(content_hash, normalize_question(question))] = answer
+
+    def invalidate(self, content_hash):
+        self.answers = {key: value for key, value in self.answers.items() if key[0] != content_hash}
+
+
+class MemoryLexicalIndexes:
+    """In-memory replacement for lexical_index.LexicalIndexStore."""
+
+    def __init__(self):
+        self.indexes = {}
+
+    def get(self, content_hash):
+        return self.indexes.get(content_hash)
+
+    def put(self, content_hash, index):
+        self.indexes[content_hash] = index
+
+
+@contextmanager
+def serve_directory(path: str):
+    """Serves `path` over HTTP on loopback so downloads exercise the real streaming code."""
+    class QuietHandler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    handler = functools.partial(QuietHandler, directory=path)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+
+
+# --- Benchmarks ---
+
+def bench_stages(timer: StageTimer, pdf_paths: list[str], embeddings, store, questions: list[str], llm):
+    """Times each ingestion and answering stage separately on every PDF."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from ingestion import CHUNK_OVERLAP, CHUNK_SIZE, EMBED_BATCH_SIZE, iter_batches, iter_chunks, iter_page_texts
+    from context_packing import pack_context
+    from processor import ANSWER_PROMPT, RETRIEVAL_K
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    answer_chain = ANSWER_PROMPT | llm
+
+    for pdf_path in pdf_paths:
+        namespace = os.path.basename(pdf_path)
+        start = time.perf_counter()
+        pages = list(iter_page_texts(pdf_path))
+        timer.record("extract_pages", time.perf_counter() - start, len(pages))
+
+        with timer.stage("chunk", items=0):
+            chunks = list(iter_chunks(pages, text_splitter))
+        timer.items["chunk"] += len(chunks)
+
+        for batch_number, batch in enumerate(iter_batches(chunks, EMBED_BATCH_SIZE)):
+            with timer.stage("embed_chunks", items=len(batch)):
+                vectors = embeddings.embed_documents(batch)
+            first = batch_number * EMBED_BATCH_SIZE
+            with timer.stage("upsert", items=len(batch)):
+                store.upsert(namespace, [f"chunk-{first + i}" for i in range(len(batch))], vectors,
+                             [{"text": text, "chunk_index": first + i} for i, text in enumerate(batch)])
+
+        with timer.stage("embed_questions", items=len(questions)):
+            query_vectors = embeddings.embed_documents(questions)
+        with timer.stage("retrieve", items=len(questions)):
+            results = store.query_many(namespace, query_vectors, RETRIEVAL_K)
+
+        for question, matches in zip(questions, results):
+            with timer.stage("pack_context"):
+                context = pack_context([doc for doc, _score in matches])
+            with timer.stage("generate"):
+                answer_chain.invoke({"context": context, "question": question})
+
+
+def bench_end_to_end(timer: StageTimer, pdf_paths: list[str], questions: list[str]):
+    """Times processor.process_document_and_questions, cold (ingest) and warm (cached)."""
+    import processor
+
+    with serve_directory(SOURCE_DOCS_PATH) as base_url:
+        for pdf_path in pdf_paths:
+            url = f"{base_url}/{os.path.basename(pdf_path)}"
+            for stage in ("end_to_end_cold", "end_to_end_warm"):
+                with timer.stage(stage, items=len(questions)):
+                    answers = processor.process_document_and_questions(url, questions)
+                # Errors are returned as answers; timing them would flatter the pipeline
+                failed = [answer for answer in answers if answer.startswith("An unexpected error occurred")]
+                if failed:
+                    raise RuntimeError(f"{stage} failed for {url}: {failed[0]}")
+
+
+def bench_claims(timer: StageTimer, pdf_paths: list[str], embeddings, store, llm_latency: float):
+    """Times query_systemCV.process_claim against a local index of all PDFs."""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "test code"))
+    import query_systemCV
+
+    for pdf_path in pdf_paths:
+        # Reuse the chunks already indexed per document under the claim collection
+        for matches in store.query_many(os.path.basename(pdf_path), embeddings.embed_documents(SAMPLE_CLAIMS), 5):
+            docs = [doc for doc, _score in matches]
+            store.upsert(query_systemCV.COLLECTION_NAME,
+                         [hashlib.sha1(doc.page_content.encode()).hexdigest() for doc in docs],
+                         embeddings.embed_documents([doc.page_content for doc in docs]),
+                         [{**doc.metadata, "text": doc.page_content} for doc in docs])
+
+    query_systemCV.embeddings = embeddings
+    query_systemCV.vector_store = store
+    query_systemCV.json_llm = make_stub_chat_llm(llm_latency)
+    for claim in SAMPLE_CLAIMS:
+        with timer.stage("process_claim"):
+            query_systemCV.process_claim(claim)
+
+
+# --- Reporting ---
+
+def compare(current: dict, baseline: dict) -> list[str]:
+    """Human-readable throughput and p50 changes against a previous run."""
+    lines = []
+    for name, stats in current["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if not old:
+            continue
+        throughput = ""
+        if stats["items_per_second"] and old["items_per_second"]:
+            throughput = f"{(stats['items_per_second'] / old['items_per_second'] - 1) * 100:+.1f}% items/s, "
+        lines.append(f"{name:>18}: {throughput}p50 {old['p50_ms']:.1f} -> {stats['p50_ms']:.1f} ms")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="bench_output.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="A previous results file to compare against")
+    parser.add_argument("--embedder", choices=["minilm", "hash"], default="minilm",
+                        help="'hash' uses deterministic pseudo-embeddings instead of MiniLM")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated latency per LLM call")
+    parser.add_argument("--questions", type=int, default=len(SAMPLE_QUESTIONS), help="Questions per document")
+    parser.add_argument("--documents", nargs="*", help="PDF file names in source_documents (default: all)")
+    parser.add_argument("--skip-end-to-end", action="store_true")
+    parser.add_argument("--skip-claims", action="store_true")
+    args = parser.parse_args()
+
+    names = args.documents or sorted(name for name in os.listdir(SOURCE_DOCS_PATH) if name.endswith(".pdf"))
+    pdf_paths = [os.path.join(SOURCE_DOCS_PATH, name) for name in names]
+    questions = (SAMPLE_QUESTIONS * (args.questions // len(SAMPLE_QUESTIONS) + 1))[:args.questions]
+    llm_latency = args.llm_latency_ms / 1000
+
+    workdir = tempfile.mkdtemp(prefix="hackrx-bench-")
+    os.environ["VECTOR_BACKEND"] = "local"
+    os.environ["LOCAL_INDEX_DIR"] = os.path.join(workdir, "vectors")
+    os.environ["EMBEDDING_CACHE_DIR"] = os.path.join(workdir, "embeddings")
+
+    import processor
+    from vector_stores import LocalStore
+
+    if args.embedder == "hash":
+        embeddings = HashEmbeddings()
+    else:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=processor.EMBEDDING_MODEL)
+    llm = make_stub_llm(llm_latency)
+    store = LocalStore(root=os.path.join(workdir, "stages"))
+
+    MemoryTracking().install(processor)
+    processor.answer_cache = MemoryAnswerCache()
+    processor.lexical_indexes = MemoryLexicalIndexes()
+    processor._database_ready = True  # Nothing to set up for the in-memory stand-ins
+    processor._embeddings = embeddings  # Uncached, so every run measures embedding compute
+    processor._llm = llm
+    processor._json_llm = make_stub_llm(llm_latency, json_mode=True)
+    processor._vector_store = LocalStore(root=os.path.join(workdir, "end_to_end"))
+
+    timer = StageTimer()
+    started = time.perf_counter()
+    benches = [("stages", bench_stages, (timer, pdf_paths, embeddings, store, questions, llm))]
+    if not args.skip_end_to_end:
+        benches.append(("end_to_end", bench_end_to_end, (timer, pdf_paths, questions)))
+    if not args.skip_claims:
+        benches.append(("claims", bench_claims, (timer, pdf_paths, embeddings, store, llm_latency)))
+    # A failing benchmark does not discard the timings of the others
+    errors = {}
+    for name, bench, bench_args in benches:
+        try:
+            bench(*bench_args)
+        except Exception as e:
+            traceback.print_exc()
+            errors[name] = f"{type(e).__name__}: {e}"
+
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "wall_seconds": round(time.perf_counter() - started, 3),
+        "config": {
+            "documents": names,
+            "questions_per_document": len(questions),
+            "embedder": args.embedder,
+            "llm_latency_ms": args.llm_latency_ms,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "stages": timer.summary(),
+        "errors": errors,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for name, stats in results["stages"].items():
+        print(f"{name:>18}: {stats['items']:>6} items  {stats['items_per_second'] or 0:>10.1f}/s  "
+              f"p50 {stats['p50_ms']:>9.2f} ms  p99 {stats['p99_ms']:>9.2f} ms")
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(["", f"Compared with {args.compare}:"] + compare(results, json.load(f))))
+    print(f"Results written to {args.output}")
+    if errors:
+        print("Failed: " + "; ".join(f"{name} ({error})" for name, error in errors.items()))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# context_packing.py
+import os
+import re
+import math
+
+# --- Packing Configuration ---
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1200"))  # Prompt tokens spent on context
+CHARS_PER_TOKEN = 4  # Rough size of a Llama 3 token in English text; avoids loading a tokenizer
+MIN_OVERLAP_CHARS = 20  # Shorter common affixes are coincidence, not splitter overlap
+MAX_OVERLAP_CHARS = 400  # Above the splitters' chunk_overlap (100-150), with room for whitespace
+MIN_REPEATED_LINE_CHARS = 30  # Shorter lines (numbers, headings) may legitimately repeat
+SEPARATOR = "\n---\n"
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def merge_overlap(left: str, right: str) -> str | None:
+    """
+    Joins two chunks if `right` starts with the end of `left`, as consecutive
+    chunks from the text splitter do. Returns None if they do not overlap.
+    """
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return None
+
+
+def _position(doc, rank: int) -> tuple:
+    """Sort key placing chunks of the same document in reading order."""
+    metadata = doc.metadata or {}
+    document = str(metadata.get("content_hash") or metadata.get("source") or "")
+    page_start, chunk_index = metadata.get("page_start"), metadata.get("chunk_index")
+    # Pages first: after an incremental re-index, unchanged chunks keep the positions of the earlier version
+    return (document, page_start if isinstance(page_start, int) else math.inf,
+            chunk_index if isinstance(chunk_index, int) else math.inf, rank)
+
+
+def _drop_repeated_lines(text: str, seen: set) -> str:
+    """Removes lines already seen in earlier passages, such as running headers and footers."""
+    kept = []
+    for line in text.splitlines():
+        key = re.sub(r"\s+", " ", line).strip().lower()
+        if len(key) >= MIN_REPEATED_LINE_CHARS:
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(line)
+    return "\n".join(kept).strip()
+
+
+def pack_context(docs: list, token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    Builds the prompt context from retrieved chunks (most relevant first).
+
+    Chunks are admitted in relevance order until the token budget is spent (the
+    first chunk that does not fit is cut at a word boundary), then put back in
+    document order, where chunks that overlap are merged and lines repeated
+    from an earlier passage are dropped. The result depends only on which chunks
+    were retrieved, so questions hitting the same chunks produce identical
+    prompts and Ollama can reuse its cached prefix.
+    """
+    budget_chars = token_budget * CHARS_PER_TOKEN
+    selected = []
+    seen_texts = set()
+    used = 0
+    for rank, doc in enumerate(docs):
+        text = doc.page_content.strip()
+        if not text or text in seen_texts:
+            continue
+        seen_texts.add(text)
+        remaining = budget_chars - used - (len(SEPARATOR) if selected else 0)
+        if len(text) > remaining:
+            cut = text[:remaining].rsplit(None, 1)[0] if remaining > MIN_OVERLAP_CHARS else ""
+            if cut:
+                selected.append((_position(doc, rank), cut))
+            break
+        selected.append((_position(doc, rank), text))
+        used += len(text) + (len(SEPARATOR) if len(selected) > 1 else 0)
+
+    passages = []  # [document, text], merged within a document only
+    for (document, *_rest), text in sorted(selected):
+        if passages and passages[-1][0] == document:
+            merged = merge_overlap(passages[-1][1], text)
+            if merged is not None:
+                passages[-1][1] = merged
+                continue
+            if text in passages[-1][1]:
+                continue
+        passages.append([document, text])
+
+    seen_lines = set()
+    passages = [_drop_repeated_lines(text, seen_lines) for _document, text in passages]
+    return SEPARATOR.join(passage for passage in passages if passage)
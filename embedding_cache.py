@@ -0,0 +1,203 @@
+# embedding_cache.py
+import os
+import re
+import json
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import metrics
+
+# --- Cache Configuration ---
+EMBEDDING_CACHE_DIR = os.environ.get(
+    "EMBEDDING_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "embeddings")
+)
+EMBEDDING_CACHE_CAPACITY = int(os.environ.get("EMBEDDING_CACHE_CAPACITY", "100000"))  # Vectors per model
+EMBEDDING_CACHE_DTYPE = os.environ.get("EMBEDDING_CACHE_DTYPE", "float32")  # or "float16" to halve the size
+EVICT_FRACTION = 0.05  # Share of the cache freed at once when it is full, to amortize eviction
+
+_KEY_BYTES = 32  # SHA-256 digest
+
+
+def embedding_key(model_name: str, text: str) -> bytes:
+    """Content address of a text's embedding under a given model."""
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    """
+    Fixed-capacity, memory-mapped store of embedding vectors keyed by content hash.
+
+    Files in `path`:
+      meta.json    dimension, dtype and capacity
+      keys.bin     capacity x 32-byte digests (all zero = free slot)
+      vectors.bin  capacity x dim vectors
+      ticks.bin    capacity x last-access clock, used for LRU eviction
+      state.bin    [generation, clock]; generation changes on every write
+    Writers hold an exclusive flock on `lock`, so several worker processes can
+    share one cache; a process rebuilds its key index when the generation moves.
+    """
+
+    def __init__(self, path: str, capacity: int = EMBEDDING_CACHE_CAPACITY, dtype: str = EMBEDDING_CACHE_DTYPE):
+        self.path = path
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        self._lock = threading.Lock()
+        self._slots: dict[bytes, int] = {}
+        self._free: list[int] = []
+        self._generation = None
+        os.makedirs(path, exist_ok=True)
+        self._lock_file = open(os.path.join(path, "lock"), "a+")
+        with self._file_lock(fcntl.LOCK_SH):
+            self._open_existing()
+
+    # --- File Handling ---
+
+    @contextmanager
+    def _file_lock(self, mode: int):
+        fcntl.flock(self._lock_file, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _open_existing(self):
+        meta_path = os.path.join(self.path, "meta.json")
+        if self.dim is not None or not os.path.exists(meta_path):
+            return
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self.dim, self.capacity, self.dtype = meta["dim"], meta["capacity"], np.dtype(meta["dtype"])
+        self._map_files("r+")
+
+    def _create(self, dim: int):
+        """Creates empty (sparse) files for a store of `dim`-dimensional vectors."""
+        self.dim = dim
+        self._map_files("w+")
+        meta_path = os.path.join(self.path, "meta.json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"dim": dim, "capacity": self.capacity, "dtype": self.dtype.name}, f)
+        os.replace(meta_path + ".tmp", meta_path)  # Written last: its presence means the files are complete
+
+    def _map_files(self, mode: str):
+        def mmap(name, dtype, shape):
+            return np.memmap(os.path.join(self.path, name), dtype=dtype, mode=mode, shape=shape)
+
+        self._keys = mmap("keys.bin", np.uint8, (self.capacity, _KEY_BYTES))
+        self._vectors = mmap("vectors.bin", self.dtype, (self.capacity, self.dim))
+        self._ticks = mmap("ticks.bin", np.uint64, (self.capacity,))
+        self._state = mmap("state.bin", np.uint64, (2,))
+
+    def _refresh(self):
+        """Rebuilds the in-memory key index if another process has written since."""
+        if self.dim is None:
+            self._open_existing()
+            if self.dim is None:
+                return
+        generation = int(self._state[0])
+        if generation == self._generation:
+            return
+        occupied = np.flatnonzero(self._keys.any(axis=1))
+        self._slots = {self._keys[slot].tobytes(): int(slot) for slot in occupied}
+        self._free = sorted(set(range(self.capacity)) - set(self._slots.values()), reverse=True)
+        self._generation = generation
+
+    def _tick(self) -> int:
+        self._state[1] += 1
+        return int(self._state[1])
+
+    # --- Public API ---
+
+    def get_many(self, keys: list[bytes]) -> list[np.ndarray | None]:
+        """Returns the cached vector for each key, or None where it is missing."""
+        with self._lock, self._file_lock(fcntl.LOCK_SH):
+            self._refresh()
+            if self.dim is None:
+                return [None] * len(keys)
+            tick = self._tick()
+            results = []
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is None:
+                    results.append(None)
+                    continue
+                self._ticks[slot] = tick
+                results.append(np.array(self._vectors[slot], dtype=np.float32))
+            return results
+
+    def put_many(self, keys: list[bytes], vectors):
+        """Stores vectors under their keys, evicting the least recently used ones if full."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(keys) == 0:
+            return
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            self._refresh()
+            if self.dim is None:
+                self._create(vectors.shape[1])
+                self._refresh()
+            tick = self._tick()
+            new = {key: vector for key, vector in zip(keys, vectors) if key not in self._slots}
+            slots = self._allocate(min(len(new), self.capacity))
+            for slot, (key, vector) in zip(slots, list(new.items())[len(new) - len(slots):]):
+                self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                self._vectors[slot] = vector
+                self._ticks[slot] = tick
+                self._slots[key] = slot
+            self._state[0] += 1
+            self._generation = int(self._state[0])
+
+    def _allocate(self, count: int) -> list[int]:
+        """Returns `count` free slots, evicting least recently used entries as needed."""
+        if count > len(self._free):
+            needed = max(count - len(self._free), int(self.capacity * EVICT_FRACTION))
+            occupied = np.fromiter(self._slots.values(), dtype=np.int64, count=len(self._slots))
+            needed = min(needed, len(occupied))
+            oldest = occupied[np.argpartition(self._ticks[occupied], needed - 1)[:needed]]
+            for slot in oldest:
+                del self._slots[self._keys[slot].tobytes()]
+                self._keys[slot] = 0
+                self._free.append(int(slot))
+        return [self._free.pop() for _ in range(count)]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._slots)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps any LangChain embeddings object with a persistent content-addressed cache.
+    Only texts that have never been embedded with this model reach the wrapped model,
+    so any vector store built on top of it benefits.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.store = EmbeddingStore(os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)))
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [embedding_key(self.model_name, text) for text in texts]
+        vectors = self.store.get_many(keys)
+
+        # Embed each missing text once, even if it repeats within the batch
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(keys[i], texts[i])
+        metrics.count_cache("embedding", hits=len(texts) - len(missing), misses=len(missing))
+        if missing:
+            computed = self.embeddings.embed_documents(list(missing.values()))
+            self.store.put_many(list(missing.keys()), computed)
+            by_key = dict(zip(missing.keys(), computed))
+            vectors = [by_key[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+
+        return [np.asarray(vector, dtype=np.float32).tolist() for vector in vectors]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
@@ -0,0 +1,169 @@
+# embedding_service.py
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import metrics
+
+# --- Service Configuration ---
+EMBED_MAX_BATCH_SIZE = int(os.environ.get("EMBED_MAX_BATCH_SIZE", "64"))  # Texts per forward pass
+EMBED_MAX_WAIT_MS = float(os.environ.get("EMBED_MAX_WAIT_MS", "5"))  # How long a batch waits for more texts
+# "huggingface" (sentence-transformers), "onnx" or "onnx-int8" (ONNX Runtime, from ONNX_MODEL_DIR)
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "huggingface")
+ONNX_MODEL_DIR = os.environ.get(
+    "ONNX_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "onnx", "all-MiniLM-L6-v2")
+)
+ONNX_THREADS = int(os.environ.get("ONNX_THREADS", "0"))  # 0 lets ONNX Runtime use every core
+ONNX_MAX_LENGTH = 256  # all-MiniLM-L6-v2's max_seq_length; longer texts are truncated as by sentence-transformers
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Serves embed calls from any number of threads through one worker thread.
+    Calls that arrive within EMBED_MAX_WAIT_MS of each other are coalesced into one
+    forward pass of up to EMBED_MAX_BATCH_SIZE texts, so concurrent requests do not
+    each run small passes that compete for the CPU.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int = EMBED_MAX_BATCH_SIZE,
+                 max_wait_ms: float = EMBED_MAX_WAIT_MS):
+        self.embeddings = embeddings
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._requests: queue.Queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        self._ensure_worker()
+        future = Future()
+        self._requests.put((list(texts), future))
+        return future.result()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    # --- Worker ---
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._worker.start()
+
+    def _collect(self) -> list:
+        """Blocks for the first request, then gathers more until the batch is full or the wait is over."""
+        requests = [self._requests.get()]
+        size = len(requests[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            texts = [text for request_texts, _future in requests for text in request_texts]
+            try:
+                vectors = []
+                for start in range(0, len(texts), self.max_batch_size):
+                    batch = texts[start:start + self.max_batch_size]
+                    metrics.observe_embedding_batch(len(batch))
+                    with metrics.span("embed_batch"):
+                        vectors.extend(self.embeddings.embed_documents(batch))
+            except BaseException as e:
+                for _texts, future in requests:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for request_texts, future in requests:
+                future.set_result(vectors[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Sentence-transformers model exported to ONNX, run with ONNX Runtime.
+    Applies the same mean pooling and L2 normalization as all-MiniLM-L6-v2's
+    sentence-transformers pipeline, so its vectors match HuggingFaceEmbeddings.
+
+    `model_dir` holds tokenizer.json and model.onnx (from e.g.
+    `optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 DIR`);
+    quantize_onnx_model() adds the int8 model_int8.onnx next to it.
+    """
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, quantized: bool = False, threads: int = ONNX_THREADS):
+        import onnxruntime  # Only needed for the ONNX backends
+        from tokenizers import Tokenizer
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        model_file = "model_int8.onnx" if quantized else "model.onnx"
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=ONNX_MAX_LENGTH)
+        self.tokenizer.enable_padding()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        encodings = self.tokenizer.encode_batch(list(texts))
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+
+        token_embeddings = self.session.run(None, inputs)[0]  # (batch, tokens, dim)
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+def quantize_onnx_model(model_dir: str = ONNX_MODEL_DIR):
+    """Writes model_int8.onnx, a dynamically int8-quantized copy of model.onnx, for EMBEDDING_BACKEND=onnx-int8."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(os.path.join(model_dir, "model.onnx"), os.path.join(model_dir, "model_int8.onnx"),
+                     weight_type=QuantType.QInt8)
+
+
+def create_embedding_backend(model_name: str, backend: str = EMBEDDING_BACKEND) -> Embeddings:
+    """Returns the embedding model for `backend`, without batching or caching."""
+    if backend == "huggingface":
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        return HuggingFaceEmbeddings(model_name=model_name)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEmbeddings(quantized=backend == "onnx-int8")
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+def embedding_cache_name(model_name: str, backend: str = EMBEDDING_BACKEND) -> str:
+    """Cache namespace for a model's vectors; int8 vectors differ slightly, so they are kept apart."""
+    return f"{model_name}-int8" if backend == "onnx-int8" else model_name
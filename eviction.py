@@ -0,0 +1,155 @@
+# eviction.py
+import os
+import logging
+from collections import Counter
+
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Eviction Configuration ---
+# Vector budgets over all ready documents and per tenant; 0 leaves them unbounded
+EVICTION_MAX_VECTORS = int(os.environ.get("EVICTION_MAX_VECTORS", "0"))
+EVICTION_TENANT_MAX_VECTORS = int(os.environ.get("EVICTION_TENANT_MAX_VECTORS", "0"))
+EVICTION_POLICY = os.environ.get("EVICTION_POLICY", "lru")  # "lru" or "lfu"
+EVICTION_INTERVAL_SECONDS = float(os.environ.get("EVICTION_INTERVAL_SECONDS", "300"))
+# Documents accessed this recently are never evicted, so requests using them finish safely
+EVICTION_GRACE_SECONDS = int(os.environ.get("EVICTION_GRACE_SECONDS", "600"))
+EVICTION_LEASE_SECONDS = int(os.environ.get("EVICTION_LEASE_SECONDS", "900"))  # An 'evicting' row older than this is retaken
+
+_POLICY_ORDER = {
+    "lru": "COALESCE(d.last_accessed, d.indexed_at) ASC",
+    "lfu": "d.hit_count ASC, COALESCE(d.last_accessed, d.indexed_at) ASC",
+}
+# Tables keyed by content hash whose rows go with an evicted document
+_DOCUMENT_TABLES = ("document_pages", "lexical_indexes", "answer_cache", "document_aliases")
+
+
+def select_victims(documents: list[tuple], max_vectors: int, tenant_max_vectors: int) -> list:
+    """
+    Picks the documents to evict so that the budgets hold.
+    `documents` holds (document ID, tenant, vectors, evictable) in eviction order;
+    documents that are not evictable still count towards the budgets.
+    """
+    total = sum(vectors for _id, _tenant, vectors, _evictable in documents)
+    per_tenant = Counter()
+    for _id, tenant, vectors, _evictable in documents:
+        per_tenant[tenant] += vectors
+
+    victims = []
+    for document_id, tenant, vectors, evictable in documents:
+        over_total = max_vectors and total > max_vectors
+        over_tenant = tenant_max_vectors and per_tenant[tenant] > tenant_max_vectors
+        if evictable and (over_total or over_tenant):
+            victims.append(document_id)
+            total -= vectors
+            per_tenant[tenant] -= vectors
+    return victims
+
+
+class DocumentEvictor:
+    """
+    Keeps the indexed documents within a vector budget by deleting the least
+    recently (LRU) or least frequently (LFU) used ones.
+
+    A document is first moved from 'ready' to 'evicting' by a conditional update
+    that fails if it was accessed within the grace period; readers touch the row
+    with the opposite condition (see processor.atouch_document), so a document is
+    either in use or being evicted, never both. Its namespace is then deleted, and
+    finally its tracking row and dependent rows, in one transaction. A worker dying
+    in between leaves an 'evicting' row, which is retaken after EVICTION_LEASE_SECONDS.
+
+    Rows left from when documents were keyed by URL (no content hash, the URL as
+    namespace) can no longer be served, and their size is unknown: every pass evicts them.
+    """
+
+    def __init__(self, max_vectors: int = EVICTION_MAX_VECTORS,
+                 tenant_max_vectors: int = EVICTION_TENANT_MAX_VECTORS, policy: str = EVICTION_POLICY,
+                 grace_seconds: int = EVICTION_GRACE_SECONDS):
+        if policy not in _POLICY_ORDER:
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.max_vectors = max_vectors
+        self.tenant_max_vectors = tenant_max_vectors
+        self.policy = policy
+        self.grace_seconds = grace_seconds
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_vectors or self.tenant_max_vectors)
+
+    def _ranked_documents(self) -> list[tuple]:
+        """Ready documents in eviction order, with their vector counts."""
+        with db.connection() as conn:
+            return conn.execute(f"""
+                SELECT d.id, d.tenant, COALESCE(d.chunk_count, l.chunk_count, 0),
+                       COALESCE(d.last_accessed, d.indexed_at) < NOW() - %s * INTERVAL '1 second'
+                FROM processed_documents d
+                LEFT JOIN lexical_indexes l ON l.content_hash = d.content_hash
+                WHERE d.status = 'ready' AND d.content_hash IS NOT NULL
+                ORDER BY {_POLICY_ORDER[self.policy]};
+            """, (self.grace_seconds,)).fetchall()
+
+    def _unreachable(self) -> list[int]:
+        """Documents whose eviction was interrupted, and rows keyed by URL only."""
+        with db.connection() as conn:
+            rows = conn.execute("""
+                SELECT id FROM processed_documents
+                WHERE (status = 'evicting' AND updated_at < NOW() - %s * INTERVAL '1 second')
+                   OR (content_hash IS NULL AND status = 'ready')
+                ORDER BY id;
+            """, (EVICTION_LEASE_SECONDS,)).fetchall()
+        return [document_id for (document_id,) in rows]
+
+    def _take(self, document_id: int) -> tuple[str, str, int] | None:
+        """
+        Marks a document 'evicting' unless it was accessed meanwhile;
+        returns its content hash (or URL), namespace and size.
+        """
+        with db.connection() as conn:
+            return conn.execute("""
+                UPDATE processed_documents SET status = 'evicting', updated_at = NOW()
+                WHERE id = %s AND (
+                    (status = 'ready'
+                     AND COALESCE(last_accessed, indexed_at) < NOW() - %s * INTERVAL '1 second')
+                    OR (status = 'evicting' AND updated_at < NOW() - %s * INTERVAL '1 second')
+                    OR (status = 'ready' AND content_hash IS NULL))
+                RETURNING COALESCE(content_hash, document_url), COALESCE(namespace, content_hash, document_url),
+                          COALESCE(chunk_count, 0);
+            """, (document_id, self.grace_seconds, EVICTION_LEASE_SECONDS)).fetchone()
+
+    def _forget(self, document_id: int, namespace: str):
+        """Deletes the tracking rows of an evicted document and of earlier versions that shared its namespace."""
+        with db.connection() as conn:
+            rows = conn.execute("""
+                DELETE FROM processed_documents
+                WHERE (id = %s AND status = 'evicting')
+                   OR (status = 'superseded' AND COALESCE(namespace, content_hash) = %s)
+                RETURNING content_hash;
+            """, (document_id, namespace)).fetchall()
+            hashes = [content_hash for (content_hash,) in rows if content_hash is not None]
+            for table in _DOCUMENT_TABLES:
+                conn.execute(f"DELETE FROM {table} WHERE content_hash = ANY(%s);", (hashes,))
+
+    def evict(self, store) -> list[str]:
+        """
+        Runs one eviction pass against `store` and returns the content hashes of the
+        evicted documents (the URLs, for rows keyed by URL).
+        """
+        documents = self._ranked_documents()
+        victims = self._unreachable() + select_victims(documents, self.max_vectors, self.tenant_max_vectors)
+        evicted, vectors = [], 0
+        for document_id in victims:
+            taken = self._take(document_id)
+            if taken is None:
+                continue  # Accessed since it was ranked
+            key, namespace, chunk_count = taken
+            store.delete_namespace(namespace)
+            self._forget(document_id, namespace)
+            evicted.append(key)
+            vectors += chunk_count
+        if evicted:
+            metrics.count_evicted(len(evicted), vectors)
+            logger.info("Evicted %d documents (%d vectors) under the %s policy.",
+                        len(evicted), vectors, self.policy.upper())
+        return evicted
@@ -0,0 +1,400 @@
+# ingestion.py
+import os
+import queue
+import logging
+import hashlib
+import tempfile
+import threading
+import contextvars
+import multiprocessing
+import requests
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import fitz  # PyMuPDF
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Pipeline Configuration ---
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+PAGE_BOUNDARY_CHARS = CHUNK_SIZE // 2  # Taken from each side of a page break for its boundary chunk
+DOWNLOAD_BLOCK_BYTES = 1024 * 1024
+DOWNLOAD_TIMEOUT_SECONDS = int(os.environ.get("DOWNLOAD_TIMEOUT_SECONDS", "60"))
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "64"))  # Chunks per embed/upsert call
+PIPELINE_QUEUE_DEPTH = int(os.environ.get("PIPELINE_QUEUE_DEPTH", "4"))  # Batches buffered between stages
+# Page text extraction of longer PDFs is spread over worker processes, in ranges of pages
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXTRACT_PAGES_PER_TASK = int(os.environ.get("EXTRACT_PAGES_PER_TASK", "8"))
+
+# Query parameters of signed URLs, which change with every signature (matched case-insensitively)
+_SIGNATURE_PARAMS = frozenset((
+    # Azure SAS
+    "sv", "ss", "srt", "st", "se", "sr", "sp", "spr", "sip", "si", "sig", "sdd",
+    "skoid", "sktid", "skt", "ske", "sks", "skv", "saoid", "suoid", "scid",
+    "rscc", "rscd", "rsce", "rscl", "rsct",
+    # AWS signature v2, CloudFront and GCS
+    "awsaccesskeyid", "signature", "expires", "key-pair-id", "policy", "googleaccessid",
+))
+_SIGNATURE_PARAM_PREFIXES = ("x-amz-", "x-goog-")
+
+_DONE = object()  # Sentinel marking the end of a stage's output
+_POLL_SECONDS = 0.1
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+
+# --- Document Fetching ---
+
+@dataclass
+class FetchedDocument:
+    """Result of a (conditional) document download."""
+    path: str | None  # Spooled PDF, or None when the server reported the document unchanged
+    content_hash: str | None  # SHA-256 of the PDF bytes
+    etag: str | None = None
+    last_modified: str | None = None
+    content_length: int | None = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.path is None
+
+
+def _is_signature_param(name: str) -> bool:
+    lowered = name.lower()
+    return lowered in _SIGNATURE_PARAMS or lowered.startswith(_SIGNATURE_PARAM_PREFIXES)
+
+
+def document_url_key(url: str) -> str:
+    """
+    Returns the stable part of a document URL.
+    Signed blob URLs (Azure SAS, S3/GCS presigned, CloudFront) differ only in their
+    signature parameters, so those are dropped; any other query parameter may select
+    a different document and is kept.
+    """
+    parts = urlsplit(url)
+    query = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not _is_signature_param(name)]
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+
+def _is_unchanged(headers, known: dict) -> bool:
+    """Checks response validators against the ones stored for the URL."""
+    etag = headers.get("ETag")
+    if etag and known.get("etag"):
+        return etag == known["etag"]
+    last_modified = headers.get("Last-Modified")
+    content_length = headers.get("Content-Length")
+    return bool(last_modified and content_length
+                and last_modified == known.get("last_modified")
+                and int(content_length) == known.get("content_length"))
+
+
+# --- Stage Functions ---
+
+def download_to_tempfile(url: str, known: dict | None = None) -> FetchedDocument:
+    """
+    Streams the document at `url` into a temporary file, hashing it on the way.
+    If `known` holds the validators from a previous download (etag, last_modified,
+    content_length), the request is conditional and the body is not downloaded
+    when the document is unchanged.
+    """
+    headers = {}
+    if known:
+        if known.get("etag"):
+            headers["If-None-Match"] = known["etag"]
+        if known.get("last_modified"):
+            headers["If-Modified-Since"] = known["last_modified"]
+
+    with requests.get(url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT_SECONDS) as response:
+        if known and response.status_code == 304:
+            return FetchedDocument(path=None, content_hash=known.get("content_hash"), **_validators(known))
+        response.raise_for_status()
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_length": int(response.headers["Content-Length"]) if "Content-Length" in response.headers else None,
+        }
+        # Some servers ignore conditional headers; compare validators before reading the body
+        if known and _is_unchanged(response.headers, known):
+            return FetchedDocument(path=None, content_hash=known.get("content_hash"), **validators)
+
+        digest = hashlib.sha256()
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for block in response.iter_content(DOWNLOAD_BLOCK_BYTES):
+                    digest.update(block)
+                    f.write(block)
+        except BaseException:
+            os.remove(path)
+            raise
+    return FetchedDocument(path=path, content_hash=digest.hexdigest(), **validators)
+
+
+def _validators(known: dict) -> dict:
+    return {key: known.get(key) for key in ("etag", "last_modified", "content_length")}
+
+
+def _get_extract_pool() -> ProcessPoolExecutor:
+    """Returns the process-wide extraction pool; spawned, since the server process runs threads."""
+    global _extract_pool
+    if _extract_pool is None:
+        with _extract_pool_lock:
+            if _extract_pool is None:
+                _extract_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS,
+                                                    mp_context=multiprocessing.get_context("spawn"))
+    return _extract_pool
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> list[str]:
+    """Worker task: the texts of pages [start, stop)."""
+    with fitz.open(pdf_path) as doc:
+        return [doc[number].get_text() for number in range(start, stop)]
+
+
+def iter_page_texts(pdf_path: str, parallel: bool = True):
+    """
+    Yields the text of each page in order.
+    Documents longer than EXTRACT_PAGES_PER_TASK pages are extracted in page ranges
+    by the worker pool (unless `parallel` is False, e.g. inside a worker already);
+    shorter ones are read one page at a time in this process.
+    """
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+        if not parallel or EXTRACT_WORKERS <= 1 or page_count <= EXTRACT_PAGES_PER_TASK:
+            for page in doc:
+                yield page.get_text()
+            return
+
+    starts = range(0, page_count, EXTRACT_PAGES_PER_TASK)
+    stops = [min(start + EXTRACT_PAGES_PER_TASK, page_count) for start in starts]
+    for texts in _get_extract_pool().map(_extract_page_range, repeat(pdf_path), starts, stops):
+        yield from texts
+
+
+def _page_tail(text: str, size: int) -> str:
+    """The last `size` characters of a page, starting at a word boundary."""
+    text = text.strip()
+    if len(text) <= size:
+        return text
+    tail = text[-size:]
+    start = tail.find(" ") + 1
+    return tail[start:] if 0 < start < len(tail) else tail
+
+
+def _page_head(text: str, size: int) -> str:
+    """The first `size` characters of a page, ending at a word boundary."""
+    text = text.strip()
+    if len(text) <= size:
+        return text
+    head = text[:size]
+    end = head.rfind(" ")
+    return head[:end] if end > 0 else head
+
+
+def iter_page_chunks(page_texts, text_splitter: RecursiveCharacterTextSplitter):
+    """
+    Splits a stream of page texts into (chunk, first page, last page) tuples, pages numbered from 1.
+    Every page is split on its own, so its chunks depend on nothing but its text and an
+    edit to one page leaves the chunks of all other pages unchanged. Text running across
+    a page break is covered by a boundary chunk joining the end of one page to the start
+    of the next (skipping blank pages), which only changes when either of them does.
+    """
+    previous_text, previous_page = "", None
+    for page_number, text in enumerate(page_texts, start=1):
+        chunks = text_splitter.split_text(text)
+        if not chunks:
+            continue
+        if previous_page is not None:
+            boundary = (_page_tail(previous_text, PAGE_BOUNDARY_CHARS) + "\n"
+                        + _page_head(text, PAGE_BOUNDARY_CHARS))
+            yield boundary, previous_page, page_number
+        for chunk in chunks:
+            yield chunk, page_number, page_number
+        previous_text, previous_page = text, page_number
+
+
+def iter_chunks(page_texts, text_splitter: RecursiveCharacterTextSplitter):
+    """Splits a stream of page texts into chunk texts (see iter_page_chunks)."""
+    for chunk, _first_page, _last_page in iter_page_chunks(page_texts, text_splitter):
+        yield chunk
+
+
+def iter_batches(items, size: int):
+    """Groups an iterable into lists of at most `size` items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# --- Pipeline Plumbing ---
+
+def _put(outbox: queue.Queue, item, failed: threading.Event) -> bool:
+    """Blocks until `item` is queued, giving up if another stage has failed."""
+    while not failed.is_set():
+        try:
+            outbox.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(inbox: queue.Queue, failed: threading.Event):
+    """Yields items from `inbox` until the upstream stage finishes or any stage fails."""
+    while not failed.is_set():
+        try:
+            item = inbox.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        yield item
+
+
+def _run_stage(items, outbox: queue.Queue, failed: threading.Event, errors: list):
+    """Thread target: pushes every item of `items` downstream, recording the first error."""
+    try:
+        for item in items:
+            if not _put(outbox, item, failed):
+                return
+    except BaseException as e:
+        errors.append(e)
+        failed.set()
+    finally:
+        _put(outbox, _DONE, failed)
+
+
+# --- Main Pipeline ---
+
+@dataclass
+class IndexedDocument:
+    """What index_pdf() stored, recorded so the next version of the document can be indexed incrementally."""
+    chunk_ids: list[str] = field(default_factory=list)  # In document order
+    page_hashes: list[str] = field(default_factory=list)  # SHA-256 of each page's text, page 1 first
+    page_chunk_ids: dict[int, list[str]] = field(default_factory=dict)  # Chunks by the page they start on
+    embedded: int = 0  # Chunks embedded and upserted; the rest were already in the namespace
+    text_bytes: int = 0  # UTF-8 size of all chunk texts, stored as metadata
+    dimension: int = 0  # Of the vectors embedded, if any
+
+    @property
+    def chunk_count(self) -> int:
+        return len(self.chunk_ids)
+
+    @property
+    def byte_size(self) -> int:
+        """Estimated size of the document's vectors (float32) and metadata in the store."""
+        return self.chunk_count * self.dimension * 4 + self.text_bytes
+
+
+def chunk_vector_id(text: str, seen: dict) -> str:
+    """
+    Content-addressed vector ID, so a chunk keeps its ID across versions of a document.
+    Repeats of the same text within a page (or boundary) are numbered via `seen`.
+    """
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:20]
+    occurrence = seen.get(digest, 0)
+    seen[digest] = occurrence + 1
+    return digest if occurrence == 0 else f"{digest}-{occurrence}"
+
+
+def index_pdf(pdf_path: str, namespace: str, embeddings, store, lexical_index=None,
+              known_chunk_ids=None) -> IndexedDocument:
+    """
+    Indexes a spooled PDF into a vector store namespace.
+    Extraction+chunking, embedding and upserting run concurrently in their own threads,
+    connected by bounded queues, so memory use depends on the batch size and queue
+    depth rather than on the size of the document. Every chunk is also added to
+    `lexical_index` (a BM25Index), if given.
+
+    Chunks whose ID is in `known_chunk_ids` (the previous version of the document,
+    stored in the same namespace) are neither embedded nor upserted: only text from
+    changed pages produces new IDs. Removing the IDs that disappeared is up to the caller.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    known_chunk_ids = known_chunk_ids or set()
+    indexed = IndexedDocument()
+    failed = threading.Event()
+    errors = []
+    chunk_batches = queue.Queue(maxsize=PIPELINE_QUEUE_DEPTH)
+    embedded_batches = queue.Queue(maxsize=PIPELINE_QUEUE_DEPTH)
+
+    def hashed_pages():
+        for text in iter_page_texts(pdf_path):
+            indexed.page_hashes.append(hashlib.sha256(text.encode("utf-8")).hexdigest())
+            yield text
+
+    def new_chunks():
+        # Repeats are numbered per page, so an edit elsewhere cannot renumber a page's chunks;
+        # text repeated on another page (e.g. a running header) is indexed only once
+        seen, unit, ids = {}, None, set()
+        page_chunks = iter_page_chunks(hashed_pages(), text_splitter)
+        for text, page_start, page_end in page_chunks:
+            if (page_start, page_end) != unit:
+                seen, unit = {}, (page_start, page_end)
+            vector_id = chunk_vector_id(text, seen)
+            if vector_id in ids:
+                continue
+            ids.add(vector_id)
+            indexed.chunk_ids.append(vector_id)
+            indexed.text_bytes += len(text.encode("utf-8"))
+            indexed.page_chunk_ids.setdefault(page_start, []).append(vector_id)
+            if lexical_index is not None:
+                lexical_index.add(vector_id, text)
+            if vector_id not in known_chunk_ids:
+                yield vector_id, {"text": text, "chunk_id": vector_id, "chunk_index": len(indexed.chunk_ids) - 1,
+                                  "page_start": page_start, "page_end": page_end}
+
+    def embed_batches():
+        for batch in _drain(chunk_batches, failed):
+            with metrics.span("embed_chunks"):
+                vectors = embeddings.embed_documents([metadata["text"] for _id, metadata in batch])
+            yield batch, vectors
+
+    extracted = metrics.timed_iter("extract_chunks", iter_batches(new_chunks(), EMBED_BATCH_SIZE))
+    # Each stage thread runs in a copy of the caller's context, so its spans reach the request's timings
+    threads = [
+        threading.Thread(target=contextvars.copy_context().run, name="ingest-extract",
+                         args=(_run_stage, extracted, chunk_batches, failed, errors)),
+        threading.Thread(target=contextvars.copy_context().run, name="ingest-embed",
+                         args=(_run_stage, embed_batches(), embedded_batches, failed, errors)),
+    ]
+    for thread in threads:
+        thread.start()
+
+    # The calling thread is the upsert stage
+    try:
+        for batch, vectors in _drain(embedded_batches, failed):
+            with metrics.span("upsert"):
+                store.upsert(
+                    namespace,
+                    ids=[vector_id for vector_id, _metadata in batch],
+                    vectors=vectors,
+                    metadatas=[metadata for _id, metadata in batch],
+                )
+            indexed.embedded += len(batch)
+            indexed.dimension = len(vectors[0])
+            if indexed.embedded == len(batch):
+                logger.info("First %d chunks indexed.", indexed.embedded)
+    except BaseException:
+        failed.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return indexed
@@ -0,0 +1,163 @@
+# ingestion_jobs.py
+import os
+import uuid
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# --- Job Configuration ---
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", "2"))  # Background ingestions run at once per process
+INGESTION_JOB_RETENTION_SECONDS = int(os.environ.get("INGESTION_JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# An unfinished job older than the ingestion lease (as in processor.py) lost its worker
+INGESTION_LEASE_SECONDS = int(os.environ.get("INGESTION_LEASE_SECONDS", "900"))
+
+_JOB_COLUMNS = ("job_id", "document_url", "status", "content_hash", "error",
+                "created_at", "started_at", "finished_at")
+
+
+class IngestionJobQueue:
+    """
+    Background document ingestion, for warming documents ahead of the questions.
+    Jobs run on a bounded thread pool; their state ('queued', 'running', 'ready'
+    or 'failed') is kept in Postgres, so any worker can report on any job.
+    """
+
+    def __init__(self, workers: int = INGESTION_WORKERS):
+        self.workers = workers
+        self._pool = None
+        self._active: dict[str, str] = {}  # URL key -> job ID, for jobs not finished in this process
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def setup(conn):
+        """Creates the job table on a connection from setup_database()."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                job_id TEXT PRIMARY KEY,
+                document_url TEXT NOT NULL,
+                url_key TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                content_hash TEXT,
+                error TEXT,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                started_at TIMESTAMP WITH TIME ZONE,
+                finished_at TIMESTAMP WITH TIME ZONE
+            );
+        """)
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingestion-job")
+        return self._pool
+
+    def active_job(self, url_key: str) -> str | None:
+        """Returns the unfinished job for a URL key in this process, if any."""
+        with self._lock:
+            return self._active.get(url_key)
+
+    def create(self, document_url: str, url_key: str) -> str:
+        """Records a queued job and returns its ID; long-finished jobs are purged on the way."""
+        job_id = uuid.uuid4().hex
+        with db.connection() as conn:
+            conn.execute("""
+                DELETE FROM ingestion_jobs WHERE finished_at < NOW() - %s * INTERVAL '1 second';
+            """, (INGESTION_JOB_RETENTION_SECONDS,))
+            conn.execute("""
+                INSERT INTO ingestion_jobs (job_id, document_url, url_key) VALUES (%s, %s, %s);
+            """, (job_id, document_url, url_key))
+        with self._lock:
+            self._active[url_key] = job_id
+        return job_id
+
+    def track(self, job_id: str, url_key: str, ingestion: Future):
+        """Records the outcome of `ingestion` (a Future of the content hash) on the job."""
+        def finish(future: Future):
+            with self._lock:
+                if self._active.get(url_key) == job_id:
+                    del self._active[url_key]
+            if future.cancelled():
+                # The ingestion itself may still finish; get() reads the outcome off the document
+                logger.warning("Lost track of ingestion job %s; its document's status will decide it", job_id)
+                return
+            error = future.exception()
+            message = (str(error) or type(error).__name__) if error else None
+            try:
+                with db.connection() as conn:
+                    conn.execute("""
+                        UPDATE ingestion_jobs
+                        SET status = %s, content_hash = %s, error = %s, finished_at = NOW(),
+                            started_at = COALESCE(started_at, NOW())
+                        WHERE job_id = %s;
+                    """, ("failed" if error else "ready", None if error else future.result(), message, job_id))
+            except Exception:
+                logger.exception("Could not record the outcome of ingestion job %s", job_id)
+
+        ingestion.add_done_callback(finish)
+
+    def mark_running(self, job_id: str):
+        with db.connection() as conn:
+            conn.execute("""
+                UPDATE ingestion_jobs SET status = 'running', started_at = COALESCE(started_at, NOW())
+                WHERE job_id = %s AND status = 'queued';
+            """, (job_id,))
+
+    def start(self, job_id: str, ingestion: Future, run, *args):
+        """
+        Queues `run(*args)`, which must resolve `ingestion`, on the worker pool.
+        If the job never runs (the pool was shut down), `ingestion` fails instead.
+        """
+        def work():
+            try:
+                self.mark_running(job_id)
+            except Exception:
+                logger.exception("Could not mark ingestion job %s as running", job_id)
+            run(*args)
+
+        def cancelled(task: Future):
+            if task.cancelled() and not ingestion.done():
+                ingestion.set_exception(RuntimeError("Ingestion job cancelled at shutdown"))
+
+        self._get_pool().submit(work).add_done_callback(cancelled)
+
+    def get(self, job_id: str) -> dict | None:
+        """
+        Returns a job's state, or None for an unknown ID.
+        An unfinished job whose document has been indexed meanwhile is reported as ready.
+        One that is still unfinished after INGESTION_LEASE_SECONDS, and is not running in
+        this process, was lost with the worker that ran it and is reported as failed.
+        """
+        with self._lock:
+            active = job_id in self._active.values()
+        with db.connection() as conn:
+            # A job whose outcome was not recorded is done once the document its URL resolved to is ready
+            conn.execute("""
+                UPDATE ingestion_jobs j
+                SET status = 'ready', content_hash = a.content_hash, error = NULL, finished_at = NOW(),
+                    started_at = COALESCE(j.started_at, NOW())
+                FROM document_aliases a
+                JOIN processed_documents d ON d.content_hash = a.content_hash
+                WHERE j.job_id = %s AND j.finished_at IS NULL AND a.url_key = j.url_key
+                  AND a.checked_at >= j.created_at AND d.status = 'ready';
+            """, (job_id,))
+            if not active:
+                conn.execute("""
+                    UPDATE ingestion_jobs
+                    SET status = 'failed', error = 'The worker running this job stopped', finished_at = NOW()
+                    WHERE job_id = %s AND finished_at IS NULL
+                      AND COALESCE(started_at, created_at) < NOW() - %s * INTERVAL '1 second';
+                """, (job_id, INGESTION_LEASE_SECONDS))
+            row = conn.execute(f"""
+                SELECT {", ".join(_JOB_COLUMNS)} FROM ingestion_jobs WHERE job_id = %s;
+            """, (job_id,)).fetchone()
+        return dict(zip(_JOB_COLUMNS, row)) if row else None
+
+    def shutdown(self):
+        """Stops taking jobs; queued ones are cancelled, running ones finish in the background."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,172 @@
+# lexical_index.py
+import os
+import re
+import json
+import zlib
+import math
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+import db
+
+# --- Index Configuration ---
+BM25_K1 = 1.2
+BM25_B = 0.75
+LEXICAL_INDEX_LRU_SIZE = int(os.environ.get("LEXICAL_INDEX_LRU_SIZE", "64"))  # Loaded indexes kept per process
+
+# Section numbers such as "4.2" stay one token; exact clause references are what lexical search is for
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)*")
+_STOPWORDS = frozenset("""
+    a an and are as at be by can do does for from has have how i if in is it its of on or our
+    the this to under was what when where which who will with would you your my me we there any
+""".split())
+
+
+def tokenize(text: str) -> list[str]:
+    """Lower-cased words and numbers without stopwords; hyphenated words yield their parts."""
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in _STOPWORDS]
+
+
+class BM25Index:
+    """
+    Inverted index over the chunks of one document, scored with Okapi BM25.
+    Built incrementally while a document is chunked, then serialized next to its
+    tracking row in Postgres. It also holds the chunk texts, so lexical hits
+    that dense search missed can be returned as Documents.
+    """
+
+    def __init__(self):
+        self.chunk_ids: list = []  # Vector IDs; chunk positions for documents indexed before those existed
+        self.texts: list[str] = []
+        self.lengths: list[int] = []
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+        self._arrays = None
+
+    def add(self, chunk_id, text: str):
+        position = len(self.chunk_ids)
+        tokens = tokenize(text)
+        self.chunk_ids.append(chunk_id)
+        self.texts.append(text)
+        self.lengths.append(len(tokens))
+        for term, frequency in Counter(tokens).items():
+            self.postings.setdefault(term, []).append((position, frequency))
+        self._arrays = None
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def _term_arrays(self):
+        """Per-term numpy arrays of (positions, BM25 term weights), computed once per index."""
+        if self._arrays is None:
+            lengths = np.asarray(self.lengths, dtype=np.float32)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(float(lengths.mean()), 1.0))
+            count = len(self.chunk_ids)
+            self._arrays = {}
+            for term, postings in self.postings.items():
+                positions = np.fromiter((p for p, _tf in postings), dtype=np.int64, count=len(postings))
+                frequencies = np.fromiter((tf for _p, tf in postings), dtype=np.float32, count=len(postings))
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                weights = idf * frequencies * (BM25_K1 + 1) / (frequencies + norm[positions])
+                self._arrays[term] = (positions, weights)
+        return self._arrays
+
+    def search(self, query: str, k: int) -> list[tuple[int, float]]:
+        """Returns up to k (position, score) pairs with a positive score, best first."""
+        arrays = self._term_arrays()
+        scores = np.zeros(len(self.chunk_ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term in arrays:
+                positions, weights = arrays[term]
+                scores[positions] += weights
+        matched = np.flatnonzero(scores)
+        if len(matched) == 0:
+            return []
+        top = matched[np.argsort(-scores[matched], kind="stable")[:k]]
+        return [(int(position), float(scores[position])) for position in top]
+
+    # --- Serialization ---
+
+    def to_bytes(self) -> bytes:
+        data = {"chunk_ids": self.chunk_ids, "texts": self.texts, "lengths": self.lengths,
+                "postings": self.postings}
+        return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+    @classmethod
+    def from_bytes(cls, payload: bytes) -> "BM25Index":
+        data = json.loads(zlib.decompress(payload))
+        index = cls()
+        index.chunk_ids, index.texts, index.lengths = data["chunk_ids"], data["texts"], data["lengths"]
+        index.postings = {term: [tuple(p) for p in postings] for term, postings in data["postings"].items()}
+        return index
+
+
+class LexicalIndexStore:
+    """Per-document BM25 indexes in Postgres, with the most recently used ones kept in memory."""
+
+    def __init__(self, lru_size: int = LEXICAL_INDEX_LRU_SIZE):
+        self.lru_size = lru_size
+        self._lru: OrderedDict[str, BM25Index | None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def setup(conn):
+        """Creates the index table on a connection from setup_database()."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS lexical_indexes (
+                content_hash TEXT PRIMARY KEY,
+                chunk_count INTEGER NOT NULL,
+                data BYTEA NOT NULL,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+            );
+        """)
+
+    def _remember(self, content_hash: str, index: BM25Index | None):
+        with self._lock:
+            self._lru[content_hash] = index
+            self._lru.move_to_end(content_hash)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def get(self, content_hash: str) -> BM25Index | None:
+        """Returns the document's index, or None if it was indexed before lexical indexes existed."""
+        with self._lock:
+            if content_hash in self._lru:
+                self._lru.move_to_end(content_hash)
+                return self._lru[content_hash]
+        with db.connection() as conn:
+            row = conn.execute("SELECT data FROM lexical_indexes WHERE content_hash = %s;",
+                               (content_hash,)).fetchone()
+        index = BM25Index.from_bytes(row[0]) if row else None
+        self._remember(content_hash, index)
+        return index
+
+    def put(self, content_hash: str, index: BM25Index):
+        with db.connection() as conn:
+            conn.execute("""
+                INSERT INTO lexical_indexes (content_hash, chunk_count, data) VALUES (%s, %s, %s)
+                ON CONFLICT (content_hash) DO UPDATE
+                    SET chunk_count = EXCLUDED.chunk_count, data = EXCLUDED.data, created_at = NOW();
+            """, (content_hash, len(index), index.to_bytes()))
+        self._remember(content_hash, index)
+
+
+def reciprocal_rank_fusion(rankings: list[list], k: int = 60) -> list[tuple[object, float]]:
+    """Fuses ranked lists of keys: each key scores the sum of 1 / (k + rank) over the lists."""
+    scores: dict = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def adaptive_cutoff(fused: list[tuple[object, float]], min_k: int, max_k: int, ratio: float) -> list:
+    """
+    Keeps the best keys while their score stays within `ratio` of the best one,
+    never fewer than `min_k` nor more than `max_k`.
+    """
+    if not fused:
+        return []
+    best = fused[0][1]
+    return [key for n, (key, score) in enumerate(fused[:max_k]) if n < min_k or score >= ratio * best]
@@ -0,0 +1,323 @@
+# llm_client.py
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+
+import httpx
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Client Configuration ---
+# Comma-separated Ollama base URLs; when unset, the LangChain Ollama client talks to the local instance
+OLLAMA_ENDPOINTS = [url.strip().rstrip("/") for url in os.environ.get("OLLAMA_ENDPOINTS", "").split(",") if url.strip()]
+OLLAMA_MAX_IN_FLIGHT = int(os.environ.get("OLLAMA_MAX_IN_FLIGHT", "4"))  # Requests per backend
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")  # How long Ollama keeps the model loaded
+OLLAMA_TIMEOUT_SECONDS = float(os.environ.get("OLLAMA_TIMEOUT_SECONDS", "300"))
+OLLAMA_ACQUIRE_TIMEOUT_SECONDS = float(os.environ.get("OLLAMA_ACQUIRE_TIMEOUT_SECONDS", "300"))  # Wait for a free slot
+# A backend is ejected after this many consecutive failures, and re-admitted once its health check passes
+OLLAMA_FAILURE_THRESHOLD = int(os.environ.get("OLLAMA_FAILURE_THRESHOLD", "3"))
+OLLAMA_HEALTH_INTERVAL_SECONDS = float(os.environ.get("OLLAMA_HEALTH_INTERVAL_SECONDS", "10"))
+
+_WAIT_POLL_SECONDS = 0.5  # Waiters also re-check this often, e.g. for re-admitted backends
+
+
+class NoBackendAvailable(RuntimeError):
+    """Every Ollama backend is ejected, or none had a free slot in time."""
+
+
+class SharedRequestInterrupted(RuntimeError):
+    """The request shared with identical ones was interrupted before it finished."""
+
+
+class _Backend:
+    """One Ollama endpoint: a persistent connection pool and its routing state."""
+
+    def __init__(self, url: str, max_in_flight: int):
+        self.url = url
+        self.max_in_flight = max_in_flight
+        self.client = httpx.Client(
+            base_url=url, timeout=OLLAMA_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight),
+        )
+        self.outstanding = 0
+        self.dispatched = 0  # Breaks ties, so idle backends take turns
+        self.failures = 0  # Consecutive
+        self.healthy = True
+
+    def __repr__(self):
+        return f"<Ollama backend {self.url} outstanding={self.outstanding} healthy={self.healthy}>"
+
+
+class OllamaPool:
+    """
+    Sends generation requests to a set of Ollama endpoints.
+    Each request goes to the healthy backend with the fewest requests outstanding,
+    at most `max_in_flight` per backend; callers wait for a slot beyond that.
+    Backends failing OLLAMA_FAILURE_THRESHOLD times in a row are ejected until a
+    background health check (GET /api/tags) passes again. Identical non-streaming
+    requests already in flight are merged into one call.
+    """
+
+    def __init__(self, endpoints: list[str], max_in_flight: int = OLLAMA_MAX_IN_FLIGHT,
+                 keep_alive: str = OLLAMA_KEEP_ALIVE):
+        if not endpoints:
+            raise ValueError("OllamaPool needs at least one endpoint")
+        self.backends = [_Backend(url, max_in_flight) for url in endpoints]
+        self.keep_alive = keep_alive
+        self._lock = threading.Condition()
+        self._async_waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._inflight_prompts: dict[str, Future] = {}
+        self._lead_tasks: set[asyncio.Task] = set()
+        self._health_thread = None
+
+    # --- Routing ---
+
+    def _try_acquire(self) -> _Backend | None:
+        """Takes a slot on the least loaded healthy backend; raises if none is healthy."""
+        with self._lock:
+            healthy = [backend for backend in self.backends if backend.healthy]
+            if not healthy:
+                raise NoBackendAvailable("All Ollama backends are ejected: "
+                                         + ", ".join(backend.url for backend in self.backends))
+            backend = min(healthy, key=lambda backend: (backend.outstanding, backend.dispatched))
+            if backend.outstanding >= backend.max_in_flight:
+                return None
+            backend.outstanding += 1
+            backend.dispatched += 1
+            return backend
+
+    def _acquire(self) -> _Backend:
+        deadline = time.monotonic() + OLLAMA_ACQUIRE_TIMEOUT_SECONDS
+        while True:
+            backend = self._try_acquire()
+            if backend is not None:
+                return backend
+            if time.monotonic() > deadline:
+                raise NoBackendAvailable("Timed out waiting for a free Ollama backend")
+            with self._lock:
+                self._lock.wait(_WAIT_POLL_SECONDS)
+
+    async def _aacquire(self) -> _Backend:
+        """Like _acquire, but waits without occupying a thread."""
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + OLLAMA_ACQUIRE_TIMEOUT_SECONDS
+        while True:
+            backend = self._try_acquire()
+            if backend is not None:
+                return backend
+            if time.monotonic() > deadline:
+                raise NoBackendAvailable("Timed out waiting for a free Ollama backend")
+            waiter = (loop, loop.create_future())
+            with self._lock:
+                self._async_waiters.append(waiter)
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter[1]), _WAIT_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+
+    def _release(self, backend: _Backend, ok: bool):
+        """Frees a slot, records the outcome and wakes up waiting callers."""
+        with self._lock:
+            backend.outstanding -= 1
+            if ok:
+                backend.failures = 0
+            else:
+                backend.failures += 1
+                if backend.healthy and backend.failures >= OLLAMA_FAILURE_THRESHOLD:
+                    backend.healthy = False
+                    logger.warning("Ejecting Ollama backend %s after %d failures.", backend.url, backend.failures)
+                    self._ensure_health_checks()
+            self._lock.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(lambda future=future: future.done() or future.set_result(None))
+
+    # --- Health checks ---
+
+    def _ensure_health_checks(self):
+        if self._health_thread is None:
+            self._health_thread = threading.Thread(target=self._check_health, name="ollama-health", daemon=True)
+            self._health_thread.start()
+
+    def _check_health(self):
+        """Thread target: probes ejected backends and re-admits those that answer."""
+        while True:
+            time.sleep(OLLAMA_HEALTH_INTERVAL_SECONDS)
+            for backend in [backend for backend in self.backends if not backend.healthy]:
+                try:
+                    backend.client.get("/api/tags", timeout=5).raise_for_status()
+                except httpx.HTTPError:
+                    continue
+                with self._lock:
+                    backend.healthy, backend.failures = True, 0
+                    self._lock.notify_all()
+                logger.info("Re-admitting Ollama backend %s.", backend.url)
+
+    # --- Requests ---
+
+    def _payload(self, model: str, prompt: str, stream: bool, format: str | None, options: dict | None) -> dict:
+        payload = {"model": model, "prompt": prompt, "stream": stream, "keep_alive": self.keep_alive}
+        if format:
+            payload["format"] = format
+        if options:
+            payload["options"] = options
+        return payload
+
+    def _post(self, backend: _Backend, payload: dict) -> str:
+        """Sends a request on a backend slot already acquired, and releases the slot."""
+        ok = False
+        try:
+            response = backend.client.post("/api/generate", json=payload)
+            # Client errors (e.g. an unknown model) are not the backend's fault
+            ok = response.status_code < 500
+            response.raise_for_status()
+            return response.json()["response"]
+        finally:
+            self._release(backend, ok)
+
+    def _share(self, payload: dict) -> tuple[str, Future, bool]:
+        """Returns the key and Future of an identical request in flight, and whether the caller leads it."""
+        key = json.dumps(payload, sort_keys=True)
+        with self._lock:
+            future = self._inflight_prompts.get(key)
+            leader = future is None
+            if leader:
+                self._inflight_prompts[key] = future = Future()
+        metrics.count_cache("llm_prompt", hits=0 if leader else 1, misses=1 if leader else 0)
+        return key, future, leader
+
+    def _unshare(self, key: str):
+        with self._lock:
+            self._inflight_prompts.pop(key, None)
+
+    def generate(self, model: str, prompt: str, format: str | None = None, options: dict | None = None) -> str:
+        """Returns the completion of `prompt`, sharing the call with identical requests in flight."""
+        key, future, leader = self._share(self._payload(model, prompt, False, format, options))
+        if leader:
+            try:
+                future.set_result(self._post(self._acquire(), json.loads(key)))
+            except Exception as e:
+                future.set_exception(e)
+            except BaseException:
+                future.set_exception(SharedRequestInterrupted("The shared Ollama request was interrupted"))
+                raise
+            finally:
+                self._unshare(key)
+        return future.result()
+
+    async def _alead(self, key: str, future: Future):
+        """Task target: makes the shared call for `key` and resolves `future`, however the task ends."""
+        try:
+            backend = await self._aacquire()
+            # The request itself runs on the backend's pooled (thread-safe) client
+            future.set_result(await asyncio.to_thread(self._post, backend, json.loads(key)))
+        except Exception as e:
+            future.set_exception(e)
+        except BaseException:
+            # E.g. cancelled as its event loop closes; never hand CancelledError to the followers
+            future.set_exception(SharedRequestInterrupted("The shared Ollama request was interrupted"))
+            raise
+        finally:
+            self._unshare(key)
+
+    async def agenerate(self, model: str, prompt: str, format: str | None = None,
+                        options: dict | None = None) -> str:
+        """
+        Async variant of generate(); waiting for a slot or a shared call does not occupy a thread.
+        The shared call runs in a task of its own, so cancelling any caller, the first one
+        included, leaves the call running for the others.
+        """
+        key, future, leader = self._share(self._payload(model, prompt, False, format, options))
+        if leader:
+            task = asyncio.ensure_future(self._alead(key, future))
+            self._lead_tasks.add(task)  # Keeps the task referenced until it finishes
+            task.add_done_callback(self._lead_tasks.discard)
+        # Shielded, since cancelling a future wrapping `future` would cancel `future` itself
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def stream(self, model: str, prompt: str, format: str | None = None, options: dict | None = None):
+        """Yields the completion of `prompt` piece by piece; streamed requests are never shared."""
+        payload = self._payload(model, prompt, True, format, options)
+        backend = self._acquire()
+        ok = False
+        try:
+            with backend.client.stream("POST", "/api/generate", json=payload) as response:
+                ok = response.status_code < 500
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if line:
+                        data = json.loads(line)
+                        if data.get("response"):
+                            yield data["response"]
+        finally:
+            self._release(backend, ok)
+
+    def close(self):
+        for backend in self.backends:
+            backend.client.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_ollama_pool() -> OllamaPool:
+    """Returns the process-wide pool over OLLAMA_ENDPOINTS, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = OllamaPool(OLLAMA_ENDPOINTS)
+    return _pool
+
+
+class PooledOllama(LLM):
+    """LangChain LLM backed by the process-wide OllamaPool."""
+
+    model: str
+    format: str | None = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "pooled-ollama"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": self.model, "format": self.format}
+
+    def _options(self, stop) -> dict | None:
+        return {"stop": stop} if stop else None
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs) -> str:
+        return get_ollama_pool().generate(self.model, prompt, self.format, self._options(stop))
+
+    async def _acall(self, prompt, stop=None, run_manager=None, **kwargs) -> str:
+        return await get_ollama_pool().agenerate(self.model, prompt, self.format, self._options(stop))
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        for piece in get_ollama_pool().stream(self.model, prompt, self.format, self._options(stop)):
+            chunk = GenerationChunk(text=piece)
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+
+def create_llm(model: str, format: str | None = None):
+    """Returns a pooled LLM when OLLAMA_ENDPOINTS is set, else LangChain's client for the local Ollama."""
+    if OLLAMA_ENDPOINTS:
+        return PooledOllama(model=model, format=format)
+    from langchain_community.llms import Ollama
+
+    return Ollama(model=model, format=format) if format else Ollama(model=model)
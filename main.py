@@ -1,11 +1,32 @@
 # main.py
-from fastapi import FastAPI, Header, HTTPException, Security
+import os
+import json
+import time
+import asyncio
+import logging
+from fastapi import FastAPI, Header, HTTPException, Response, Security
+from fastapi.responses import StreamingResponse
 from fastapi.security import APIKeyHeader
 from pydantic import BaseModel, HttpUrl
 from typing import List
 
 # Import the core logic from our processor file
-from processor import process_document_and_questions
+from processor import aprocess_document_and_questions, astream_document_and_questions
+import processor
+import db
+from eviction import EVICTION_INTERVAL_SECONDS
+import metrics
+
+# --- Logging ---
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+logger = logging.getLogger("main")
+
+# Warm-up is retried until it succeeds, e.g. while Postgres or Ollama are still starting
+WARMUP_RETRY_SECONDS = float(os.environ.get("WARMUP_RETRY_SECONDS", "5"))
+READINESS_DB_TIMEOUT_SECONDS = float(os.environ.get("READINESS_DB_TIMEOUT_SECONDS", "2"))
 
 # --- API Setup ---
 app = FastAPI(
@@ -34,30 +55,174 @@ class RequestPayload(BaseModel):
 class ResponsePayload(BaseModel):
     answers: List[str]
 
+class DocumentPayload(BaseModel):
+    documents: HttpUrl
+
 # --- API Endpoint ---
 @app.post("/hackrx/run", response_model=ResponsePayload)
 async def run_hackrx(
     payload: RequestPayload,
-    api_key: str = Security(get_api_key)
+    response: Response,
+    api_key: str = Security(get_api_key),
+    debug_timing: str | None = Header(None, alias="X-Debug-Timing"),
+    tenant: str | None = Header(None, alias="X-Tenant"),
 ):
     """
     This endpoint receives a document URL and a list of questions,
     and returns a list of answers derived from the document.
+    Send `X-Debug-Timing: 1` to get a per-stage Server-Timing header with the response.
+    `X-Tenant` attributes new documents to a tenant, for per-tenant eviction budgets.
     """
-    print(f"Received request for document: {payload.documents}")
+    logger.info("Received request for document: %s (%d questions)", payload.documents, len(payload.questions))
+    start = time.perf_counter()
 
-    # Call the processing function from processor.py
-    answers = process_document_and_questions(
-        pdf_url=str(payload.documents),
-        questions=payload.questions
-    )
+    # Call the processing function from processor.py; it runs ingestion in a worker
+    # thread and answers questions concurrently, so the event loop stays free
+    with metrics.in_flight("requests"), metrics.request_timings() as timings:
+        answers = await aprocess_document_and_questions(
+            pdf_url=str(payload.documents),
+            questions=payload.questions,
+            tenant=tenant,
+        )
+    elapsed = time.perf_counter() - start
+    metrics.observe("request", elapsed)
 
-    print("Request complete. Returning answers.")
+    if debug_timing:
+        timings["total"] = elapsed
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+    logger.info("Request complete in %.2fs. Returning answers.", elapsed)
     return {"answers": answers}
 
+@app.post("/hackrx/run/stream")
+async def run_hackrx_stream(
+    payload: RequestPayload,
+    tokens: bool = False,
+    accept: str | None = Header(None),
+    tenant: str | None = Header(None, alias="X-Tenant"),
+    api_key: str = Security(get_api_key),
+):
+    """
+    Streaming variant of /hackrx/run. Emits an "indexed" event once the document is ready,
+    then an "answer" event with the question's index as soon as each answer is generated,
+    and a final "done" event. With `?tokens=true`, "token" events carry the answers as
+    they are generated. The body is NDJSON, or Server-Sent Events when the client
+    accepts text/event-stream.
+    """
+    logger.info("Received streaming request for document: %s (%d questions)",
+                payload.documents, len(payload.questions))
+    sse = "text/event-stream" in (accept or "")
+
+    def encode(event: dict) -> str:
+        data = json.dumps(event)
+        return f"event: {event['event']}\ndata: {data}\n\n" if sse else data + "\n"
+
+    async def events():
+        start = time.perf_counter()
+        with metrics.in_flight("requests"):
+            async for event in astream_document_and_questions(
+                pdf_url=str(payload.documents), questions=payload.questions, stream_tokens=tokens, tenant=tenant
+            ):
+                yield encode(event)
+        metrics.observe("request", time.perf_counter() - start)
+        yield encode({"event": "done"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        # Proxies must pass events through as they are written
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --- Background ingestion ---
+@app.post("/documents", status_code=202)
+async def prefetch_document(
+    payload: DocumentPayload,
+    tenant: str | None = Header(None, alias="X-Tenant"),
+    api_key: str = Security(get_api_key),
+):
+    """
+    Indexes a document in the background, so later questions about it skip ingestion.
+    Returns a job ID to poll at /documents/jobs/{job_id}; /hackrx/run requests for the
+    document meanwhile wait for this ingestion instead of starting their own.
+    """
+    job_id = await asyncio.to_thread(processor.submit_ingestion_job, str(payload.documents), tenant)
+    logger.info("Queued ingestion job %s for document: %s", job_id, payload.documents)
+    return {"job_id": job_id, "status_url": f"/documents/jobs/{job_id}"}
+
+@app.get("/documents/jobs/{job_id}")
+async def read_ingestion_job(job_id: str, api_key: str = Security(get_api_key)):
+    """Reports a job's status: queued, running, ready (with the content hash) or failed (with the error)."""
+    job = await asyncio.to_thread(processor.get_ingestion_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+# --- Lifecycle ---
+async def warm_up_until_ready():
+    """Loads models and prepares the database in the background, so liveness is served meanwhile."""
+    while True:
+        try:
+            await asyncio.to_thread(processor.warm_up)
+            logger.info("Warm-up complete; ready for traffic.")
+            return
+        except Exception as e:
+            logger.warning("Warm-up incomplete (%s); retrying in %gs.", e, WARMUP_RETRY_SECONDS)
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+async def evict_periodically():
+    """Keeps the indexed documents within the vector budget (a no-op unless one is configured)."""
+    while True:
+        await asyncio.sleep(EVICTION_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(processor.evict_documents)
+        except Exception:
+            logger.exception("Document eviction failed; retrying in %gs.", EVICTION_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_warm_up():
+    app.state.warm_up_task = asyncio.create_task(warm_up_until_ready())
+    app.state.eviction_task = asyncio.create_task(evict_periodically())
+
+@app.on_event("shutdown")
+async def close_database_pools():
+    app.state.warm_up_task.cancel()
+    app.state.eviction_task.cancel()
+    processor.ingestion_jobs.shutdown()
+    await db.aclose_pools()
+
 # --- Root endpoint for health check ---
 @app.get("/")
 def read_root():
     return {"status": "API is running"}
 
+# --- Liveness and readiness probes ---
+@app.get("/healthz")
+def read_liveness():
+    """The process is up and serving HTTP; it may still be warming up."""
+    return {"status": "alive"}
+
+async def ping_database():
+    async with db.async_connection() as conn:
+        await conn.execute("SELECT 1;")
+
+@app.get("/readyz")
+async def read_readiness(response: Response):
+    """Ready once warm-up has finished and Postgres answers; returns 503 otherwise."""
+    components = processor.warm_up_status()
+    ready = processor.is_warm()
+    if ready:
+        try:
+            await asyncio.wait_for(ping_database(), READINESS_DB_TIMEOUT_SECONDS)
+        except Exception as e:
+            components["database"] = f"error: {str(e) or type(e).__name__}"
+            ready = False
+    if not ready:
+        response.status_code = 503
+    return {"status": "ready" if ready else "warming_up", "components": components}
+
+# --- Prometheus metrics ---
+@app.get("/metrics")
+def read_metrics():
+    return Response(content=metrics.render_latest(), media_type=metrics.CONTENT_TYPE)
+
 # To run the server locally: uvicorn main:app --reload
\ No newline at end of file
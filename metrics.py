@@ -0,0 +1,135 @@
+# metrics.py
+import os
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Metric Definitions ---
+# With several uvicorn workers, set PROMETHEUS_MULTIPROC_DIR so /metrics aggregates all of them
+STAGE_SECONDS = Histogram(
+    "hackrx_stage_seconds", "Time spent in each processing stage.", ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+CACHE_LOOKUPS = Counter(
+    "hackrx_cache_lookups_total", "Cache lookups by cache and result (hit or miss).", ["cache", "result"],
+)
+GROUPED_ANSWERS = Counter(
+    "hackrx_grouped_answers_total", "Questions sent in grouped LLM calls, by outcome (answered or fallback).",
+    ["result"],
+)
+EMBEDDING_BATCH_TEXTS = Histogram(
+    "hackrx_embedding_batch_texts", "Texts per embedding forward pass.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+EVICTED_DOCUMENTS = Counter("hackrx_evicted_documents_total", "Documents evicted to keep within the vector budget.")
+EVICTED_VECTORS = Counter("hackrx_evicted_vectors_total", "Vectors deleted by document eviction.")
+IN_FLIGHT = Gauge(
+    "hackrx_in_flight", "Work currently in progress, by kind.", ["kind"], multiprocess_mode="livesum",
+)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Per-request breakdown, only collected when a request asks for it
+_request_timings: contextvars.ContextVar[dict | None] = contextvars.ContextVar("request_timings", default=None)
+
+
+# --- Recording ---
+
+def observe(stage: str, seconds: float):
+    """Records a stage duration in the histogram and in the current request's breakdown."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+    logger.debug("stage=%s duration_ms=%.1f", stage, seconds * 1000)
+
+
+@contextmanager
+def span(stage: str):
+    """Times the enclosed block as one occurrence of `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def timed_iter(stage: str, items):
+    """Yields from `items`, timing the production of each item as `stage`."""
+    iterator = iter(items)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        observe(stage, time.perf_counter() - start)
+        yield item
+
+
+def count_cache(cache: str, hits: int, misses: int):
+    """Adds the outcome of a (batched) cache lookup."""
+    if hits:
+        CACHE_LOOKUPS.labels(cache, "hit").inc(hits)
+    if misses:
+        CACHE_LOOKUPS.labels(cache, "miss").inc(misses)
+
+
+def count_grouped(answered: int, fallback: int):
+    """Adds the outcome of a grouped LLM call."""
+    if answered:
+        GROUPED_ANSWERS.labels("answered").inc(answered)
+    if fallback:
+        GROUPED_ANSWERS.labels("fallback").inc(fallback)
+
+
+def observe_embedding_batch(size: int):
+    EMBEDDING_BATCH_TEXTS.observe(size)
+
+
+def count_evicted(documents: int, vectors: int):
+    EVICTED_DOCUMENTS.inc(documents)
+    EVICTED_VECTORS.inc(vectors)
+
+
+def in_flight(kind: str):
+    """Context manager counting the enclosed block as in-flight work of `kind`."""
+    return IN_FLIGHT.labels(kind).track_inprogress()
+
+
+# --- Reporting ---
+
+@contextmanager
+def request_timings():
+    """
+    Collects the stage durations of the enclosed request into the yielded dict.
+    Work started from it (asyncio tasks, asyncio.to_thread) inherits the collector;
+    stages that run concurrently, such as generation, are summed.
+    """
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def server_timing_header(timings: dict) -> str:
+    """Formats a timing breakdown as a Server-Timing header value."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+def render_latest() -> bytes:
+    """Returns all metrics in the Prometheus text format."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -1,27 +1,33 @@
 # query_system.py
+import os
+import sys
 import json
 from langchain_community.llms import Ollama
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Milvus
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from context_packing import pack_context
+from vector_stores import create_vector_store
 
 # --- Configuration ---
 MILVUS_HOST = "localhost"
 MILVUS_PORT = "19530"
 COLLECTION_NAME = "insurance_policies_db"
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "milvus")  # or "local" to run without Milvus
 
 # --- Initialize necessary components ---
 llm = Ollama(model="llama3", format="json") # LLM configured for JSON output
 embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
 
-# Connect to the existing Milvus collection
-vector_store = Milvus(
-    embedding_function=embeddings,
-    collection_name=COLLECTION_NAME,
+# Connect to the existing collection through the shared vector store interface
+vector_store = create_vector_store(
+    VECTOR_BACKEND,
+    embeddings=embeddings,
     connection_args={"host": MILVUS_HOST, "port": MILVUS_PORT},
 )
-retriever = vector_store.as_retriever(search_kwargs={'k': 5}) # Retrieve top 5 relevant chunks
+RETRIEVAL_K = 5 # Retrieve top 5 relevant chunks
 
 # --- Define Prompts for each step ---
 
@@ -70,10 +76,11 @@ def process_claim(query: str):
     parsed_query = parser_chain.invoke({"query": query})
     print(f" -> Parsed Query: {json.dumps(parsed_query)}")
 
-    # 2. Retrieve relevant clauses from Milvus
+    # 2. Retrieve relevant clauses from the vector store
     print("Step 2: Retrieving relevant clauses...")
-    retrieved_docs = retriever.invoke(query)
-    context = "\n---\n".join([doc.page_content for doc in retrieved_docs])
+    matches = vector_store.query(COLLECTION_NAME, embeddings.embed_query(query), k=RETRIEVAL_K)
+    retrieved_docs = [doc for doc, _score in matches]
+    context = pack_context(retrieved_docs)
     print(f" -> Retrieved {len(retrieved_docs)} relevant clauses.")
 
     # 3. Evaluate and generate the final decision
@@ -1,35 +1,100 @@
+"""
+Evaluates insurance claims against the indexed policies.
+
+Run without arguments for the sample claim, or process a JSONL backlog of claims:
+    python query_systemCV.py --batch claims.jsonl --output decisions.jsonl --concurrency 8
+Each input line holds a claim ("query", "claim" or "body") and optionally an ID
+("claim_id", "request_id" or "id"; the line number otherwise). Decisions are appended
+to the output as they complete; rerunning skips claims already decided there and
+retries the ones that failed.
+"""
+import os
+import sys
 import json
-# Use the new, more specific langchain packages
-from langchain_ollama.chat_models import ChatOllama
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_milvus.vectorstores import Milvus
+import random
+import asyncio
+import argparse
 from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from context_packing import pack_context
+from llm_client import OLLAMA_ENDPOINTS, PooledOllama
+from vector_stores import create_vector_store
 
 # --- Configuration ---
 MILVUS_HOST = "localhost"
 MILVUS_PORT = "19530"
 COLLECTION_NAME = "insurance_policies_db"
 LLM_MODEL = "llama3.1:8b-instruct"  # Use a specific, recommended instruct model
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "milvus")  # or "local" to run without Milvus
+RETRIEVAL_K = 5
+# Batch mode
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))  # Claims evaluated at once
+CLAIM_RETRIES = int(os.environ.get("CLAIM_RETRIES", "2"))  # Further attempts for a failing claim
+RETRY_BACKOFF_SECONDS = 2.0
 
 # --- Component Initialization ---
-print("Initializing components...")
-# LLM for structured JSON output
-json_llm = ChatOllama(model=LLM_MODEL, format="json")
-# LLM for natural language conversation/generation
-conversational_llm = ChatOllama(model=LLM_MODEL)
-# Embeddings model
-embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
-# --- CORRECTED PART ---
-# The new Milvus class takes `embeddings` instead of `embedding_function`
-vector_store = Milvus(
-    embeddings=embeddings,
-    collection_name=COLLECTION_NAME,
-    connection_args={"host": MILVUS_HOST, "port": MILVUS_PORT},
-)
-retriever = vector_store.as_retriever(search_kwargs={'k': 5})
-print("Components initialized successfully.")
+# Created on first use, so that importing this module (as benchmark.py does, substituting
+# its own components) loads no models and needs no Ollama or Milvus
+json_llm = None  # LLM for structured JSON output
+conversational_llm = None  # LLM for natural language conversation/generation
+embeddings = None
+vector_store = None
+
+
+def _create_llm(format: str | None = None):
+    if OLLAMA_ENDPOINTS:
+        # Requests are spread over the Ollama replicas, with a bounded number in flight on each
+        return PooledOllama(model=LLM_MODEL, format=format)
+    # Use the new, more specific langchain packages
+    from langchain_ollama.chat_models import ChatOllama
+
+    return ChatOllama(model=LLM_MODEL, format=format) if format else ChatOllama(model=LLM_MODEL)
+
+
+def get_json_llm():
+    global json_llm
+    if json_llm is None:
+        json_llm = _create_llm(format="json")
+    return json_llm
+
+
+def get_conversational_llm():
+    global conversational_llm
+    if conversational_llm is None:
+        conversational_llm = _create_llm()
+    return conversational_llm
+
+
+def get_embeddings():
+    global embeddings
+    if embeddings is None:
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    return embeddings
+
+
+def get_vector_store():
+    global vector_store
+    if vector_store is None:
+        # The collection is used as the namespace of the shared vector store interface
+        vector_store = create_vector_store(
+            VECTOR_BACKEND,
+            embeddings=get_embeddings(),
+            connection_args={"host": MILVUS_HOST, "port": MILVUS_PORT},
+        )
+    return vector_store
+
+
+def init_components():
+    """Creates every component up front, so a misconfiguration shows before any claim is processed."""
+    print("Initializing components...")
+    get_json_llm()
+    get_conversational_llm()
+    get_vector_store()
+    print("Components initialized successfully.")
 
 # --- Prompt Definitions ---
 
@@ -89,23 +154,34 @@ FORMAL_RESPONSE_PROMPT = PromptTemplate(
 
 # --- Function Definitions ---
 
-def process_claim(query: str):
-    """Produces the structured JSON decision."""
-    print(f"\nProcessing query: '{query}'")
+def retrieve_clauses(query: str) -> list:
+    """Retrieves the policy chunks for a claim, searching with the raw query."""
+    matches = get_vector_store().query(COLLECTION_NAME, get_embeddings().embed_query(query), k=RETRIEVAL_K)
+    return [doc for doc, _score in matches]
 
-    print("Step 1: Parsing user query...")
-    parser_chain = QUERY_PARSER_PROMPT | json_llm | JsonOutputParser()
-    parsed_query = parser_chain.invoke({"query": query})
-    print(f" -> Parsed Query: {json.dumps(parsed_query)}")
 
-    print("Step 2: Retrieving relevant clauses...")
-    retrieved_docs = retriever.invoke(query)
-    context = "\n---\n".join([doc.page_content for doc in retrieved_docs])
-    print(f" -> Retrieved {len(retrieved_docs)} relevant clauses.")
+async def aprocess_claim(query: str, verbose: bool = True) -> dict:
+    """
+    Produces the structured JSON decision.
+    Retrieval only needs the raw query, so it runs while the parser LLM works.
+    """
+    log = print if verbose else (lambda *args: None)
+    log(f"\nProcessing query: '{query}'")
 
-    print("Step 3: Evaluating and making a final decision...")
-    decision_chain = DECISION_MAKER_PROMPT | json_llm | JsonOutputParser()
-    final_decision = decision_chain.invoke({
+    log("Step 1+2: Parsing user query and retrieving relevant clauses...")
+    parser_chain = QUERY_PARSER_PROMPT | get_json_llm() | JsonOutputParser()
+    parsed_query, retrieved_docs = await asyncio.gather(
+        parser_chain.ainvoke({"query": query}),
+        asyncio.to_thread(retrieve_clauses, query),
+    )
+    log(f" -> Parsed Query: {json.dumps(parsed_query)}")
+    # Overlapping chunks are merged and the context is capped at CONTEXT_TOKEN_BUDGET tokens
+    context = pack_context(retrieved_docs)
+    log(f" -> Retrieved {len(retrieved_docs)} relevant clauses.")
+
+    log("Step 3: Evaluating and making a final decision...")
+    decision_chain = DECISION_MAKER_PROMPT | get_json_llm() | JsonOutputParser()
+    final_decision = await decision_chain.ainvoke({
         "parsed_query": json.dumps(parsed_query),
         "context": context
     })
@@ -114,18 +190,121 @@ def process_claim(query: str):
     return final_decision
 
 
-def generate_formal_response(decision_json: dict):
+def process_claim(query: str):
+    """Produces the structured JSON decision."""
+    return asyncio.run(aprocess_claim(query))
+
+
+async def agenerate_formal_response(decision_json: dict) -> str:
     """Converts the JSON decision into a formal letter for the user."""
-    response_chain = FORMAL_RESPONSE_PROMPT | conversational_llm
-    formal_output = response_chain.invoke({
+    response_chain = FORMAL_RESPONSE_PROMPT | get_conversational_llm() | StrOutputParser()
+    return await response_chain.ainvoke({
         "decision_json_str": json.dumps(decision_json, indent=2)
     })
-    return formal_output
+
+
+def generate_formal_response(decision_json: dict) -> str:
+    """Converts the JSON decision into a formal letter for the user."""
+    return asyncio.run(agenerate_formal_response(decision_json))
+
+
+# --- Batch Mode ---
+
+def read_claims(path: str) -> list[tuple[str, str]]:
+    """Reads (claim ID, query) pairs from a JSONL file."""
+    claims = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            claim_id = record.get("claim_id") or record.get("request_id") or record.get("id") or line_number
+            query = record.get("query") or record.get("claim") or record.get("body")
+            if not query:
+                raise ValueError(f"{path}:{line_number} has no query")
+            claims.append((str(claim_id), query))
+    return claims
+
+
+def read_checkpoint(path: str) -> set[str]:
+    """Returns the IDs of the claims already decided in an output file."""
+    done = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # A line cut off by an interrupted run
+                if record.get("status") == "ok":
+                    done.add(record["claim_id"])
+    return done
+
+
+async def evaluate_claim(claim_id: str, query: str, formal: bool, retries: int) -> dict:
+    """Decides one claim, retrying with exponential backoff; failures become error records."""
+    for attempt in range(retries + 1):
+        try:
+            decision = await aprocess_claim(query, verbose=False)
+            record = {"claim_id": claim_id, "status": "ok", "query": query, "decision": decision}
+            if formal:
+                record["formal_response"] = await agenerate_formal_response(decision)
+            return record
+        except Exception as e:
+            if attempt == retries:
+                return {"claim_id": claim_id, "status": "error", "query": query, "error": str(e),
+                        "attempts": attempt + 1}
+            await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt * (0.5 + random.random()))
+
+
+async def run_batch(input_path: str, output_path: str, concurrency: int = BATCH_CONCURRENCY,
+                    retries: int = CLAIM_RETRIES, formal: bool = False) -> tuple[int, int]:
+    """
+    Evaluates every claim not yet decided in `output_path`, `concurrency` at a time,
+    appending one JSON record per claim as it completes. Returns (decided, failed).
+    """
+    done = read_checkpoint(output_path)
+    claims = [(claim_id, query) for claim_id, query in read_claims(input_path) if claim_id not in done]
+    print(f"{len(claims)} claims to evaluate ({len(done)} already decided).")
+
+    pending: asyncio.Queue = asyncio.Queue()
+    for claim in claims:
+        pending.put_nowait(claim)
+    counts = {"ok": 0, "error": 0}
+
+    with open(output_path, "a") as output:
+        async def worker():
+            while not pending.empty():
+                claim_id, query = pending.get_nowait()
+                record = await evaluate_claim(claim_id, query, formal, retries)
+                # One line per claim, flushed at once, so an interrupted run resumes where it stopped
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+                counts[record["status"]] += 1
+                print(f" -> {claim_id}: {record['decision'].get('decision') if record['status'] == 'ok' else 'error'} "
+                      f"({counts['ok'] + counts['error']}/{len(claims)})")
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return counts["ok"], counts["error"]
 
 
 # --- Main Execution Block ---
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", metavar="CLAIMS_JSONL", help="Evaluate the claims in a JSONL file")
+    parser.add_argument("--output", default="decisions.jsonl", help="Decisions JSONL, also the checkpoint")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--retries", type=int, default=CLAIM_RETRIES)
+    parser.add_argument("--formal", action="store_true", help="Also write the formal reply for each claim")
+    args = parser.parse_args()
+    init_components()
+
+    if args.batch:
+        decided, failed = asyncio.run(run_batch(args.batch, args.output, args.concurrency, args.retries, args.formal))
+        print(f"\nDone: {decided} decided, {failed} failed" + ("; rerun to retry the failed claims." if failed else "."))
+        sys.exit(1 if failed else 0)
+
     try:
         sample_query = "My son, who is 19, needs dental braces. Our family policy is 2 years old. Is this covered?"
 
@@ -139,9 +318,8 @@ if __name__ == '__main__':
         print("\n--- FORMAL RESPONSE FOR USER ---")
         formal_response = generate_formal_response(structured_result)
 
-        # Print the clean text content from the AIMessage object
-        print(formal_response.content)
+        print(formal_response)
 
     except Exception as e:
         print(f"\nAn error occurred: {e}")
-        print("\nPlease ensure both your vector database (Milvus/Postgres) and Ollama services are running.")
\ No newline at end of file
+        print("\nPlease ensure both your vector database (Milvus/Postgres) and Ollama services are running.")
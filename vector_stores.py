@@ -0,0 +1,377 @@
+# vector_stores.py
+import os
+import re
+import json
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_core.documents import Document
+
+# --- Backend Configuration ---
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "pinecone")  # "pinecone", "local", "milvus" or "pgvector"
+LOCAL_INDEX_DIR = os.environ.get(
+    "LOCAL_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "vectors")
+)
+LOCAL_INDEX_QUANTIZE = os.environ.get("LOCAL_INDEX_QUANTIZE", "0") == "1"  # int8 rows with a float32 scale
+PINECONE_UPSERT_BATCH_SIZE = 100
+QUERY_POOL_SIZE = int(os.environ.get("RETRIEVAL_POOL_SIZE", "8"))  # Concurrent queries for remote stores
+
+TEXT_KEY = "text"  # Metadata key holding the chunk text, as in langchain_pinecone
+
+
+def _to_document(metadata: dict) -> Document:
+    metadata = dict(metadata)
+    return Document(page_content=metadata.pop(TEXT_KEY, ""), metadata=metadata)
+
+
+# --- Interface ---
+
+class VectorStore(ABC):
+    """
+    Minimal vector store used by ingestion and retrieval.
+    Each document lives in its own namespace; the chunk text is stored in the
+    metadata under TEXT_KEY and comes back as the Document's page_content.
+    """
+
+    @abstractmethod
+    def upsert(self, namespace: str, ids: list[str], vectors, metadatas: list[dict]):
+        """Inserts or replaces vectors by id."""
+
+    @abstractmethod
+    def query(self, namespace: str, vector, k: int) -> list[tuple[Document, float]]:
+        """Returns the k most similar chunks with their scores, best first."""
+
+    def query_many(self, namespace: str, vectors, k: int) -> list[list[tuple[Document, float]]]:
+        """Runs one query per vector; backends override this to batch."""
+        return [self.query(namespace, vector, k) for vector in vectors]
+
+    @abstractmethod
+    def delete(self, namespace: str, ids: list[str]):
+        """Deletes vectors by id."""
+
+    @abstractmethod
+    def delete_namespace(self, namespace: str):
+        """Deletes every vector of a document."""
+
+
+# --- Pinecone ---
+
+class PineconeStore(VectorStore):
+    """Pinecone index with one namespace per document."""
+
+    def __init__(self, index):
+        self.index = index
+        self._pool = ThreadPoolExecutor(max_workers=QUERY_POOL_SIZE, thread_name_prefix="pinecone-query")
+
+    def upsert(self, namespace, ids, vectors, metadatas):
+        records = [
+            {"id": id_, "values": list(map(float, vector)), "metadata": metadata}
+            for id_, vector, metadata in zip(ids, vectors, metadatas)
+        ]
+        for start in range(0, len(records), PINECONE_UPSERT_BATCH_SIZE):
+            self.index.upsert(vectors=records[start:start + PINECONE_UPSERT_BATCH_SIZE], namespace=namespace)
+
+    def query(self, namespace, vector, k):
+        response = self.index.query(vector=list(map(float, vector)), top_k=k,
+                                    namespace=namespace, include_metadata=True)
+        return [(_to_document(match["metadata"] or {}), match["score"]) for match in response["matches"]]
+
+    def query_many(self, namespace, vectors, k):
+        # The query API takes one vector per call, so the calls are issued concurrently
+        return list(self._pool.map(lambda vector: self.query(namespace, vector, k), vectors))
+
+    def delete(self, namespace, ids):
+        for start in range(0, len(ids), 1000):
+            self.index.delete(ids=ids[start:start + 1000], namespace=namespace)
+
+    def delete_namespace(self, namespace):
+        self.index.delete(delete_all=True, namespace=namespace)
+
+
+# --- Local (NumPy / mmap) ---
+
+class _LocalNamespace:
+    """
+    One document's vectors on disk, in `path`:
+      meta.json      dimension and storage dtype ("float32" or "int8")
+      vectors.bin    rows x dim, L2-normalized; appended to on upsert
+      scales.bin     per-row float32 scale (int8 only)
+      records.jsonl  {"row", "id", "metadata"} per write, or {"row", "deleted": true};
+                     later lines for the same row win
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dim = None
+        self.dtype = None
+        self.rows = 0
+        self.ids: dict[str, int] = {}
+        self.metadatas: list[dict | None] = []
+        self.live = np.zeros(0, dtype=bool)
+        self.vectors = None
+        self.scales = None
+        self._loaded_size = -1
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def exists(self) -> bool:
+        return os.path.exists(self._file("meta.json"))
+
+    def refresh(self):
+        """(Re)loads the namespace if its files changed since the last load, e.g. in another worker."""
+        if not self.exists():
+            self.__init__(self.path)
+            return
+        size = os.path.getsize(self._file("records.jsonl"))
+        if size == self._loaded_size:
+            return
+        with open(self._file("meta.json")) as f:
+            meta = json.load(f)
+        self.dim, self.dtype = meta["dim"], np.dtype(meta["dtype"])
+        row_bytes = self.dim * self.dtype.itemsize
+        vector_rows = os.path.getsize(self._file("vectors.bin")) // row_bytes
+
+        ids, metadatas, live = {}, [None] * vector_rows, np.zeros(vector_rows, dtype=bool)
+        if size:
+            with open(self._file("records.jsonl")) as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # Partially written last line
+                    record = json.loads(line)
+                    row = record["row"]
+                    if row >= vector_rows:
+                        continue
+                    old = metadatas[row]
+                    if old is not None and ids.get(old["id"]) == row:
+                        del ids[old["id"]]
+                    if record.get("deleted"):
+                        metadatas[row], live[row] = None, False
+                    else:
+                        metadatas[row], live[row] = {"id": record["id"], **record["metadata"]}, True
+                        ids[record["id"]] = row
+
+        self.rows, self.ids, self.metadatas, self.live = vector_rows, ids, metadatas, live
+        self.vectors = (np.memmap(self._file("vectors.bin"), dtype=self.dtype, mode="r", shape=(vector_rows, self.dim))
+                        if vector_rows else np.zeros((0, self.dim), dtype=self.dtype))
+        self.scales = None
+        if self.dtype == np.int8:
+            self.scales = (np.fromfile(self._file("scales.bin"), dtype=np.float32, count=vector_rows)
+                           if vector_rows else np.zeros(0, dtype=np.float32))
+        self._loaded_size = size
+
+    def _encode(self, vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray | None]:
+        if self.dtype != np.int8:
+            return vectors.astype(self.dtype), None
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def upsert(self, ids: list[str], vectors: np.ndarray, metadatas: list[dict], quantize: bool):
+        if not self.exists():
+            os.makedirs(self.path, exist_ok=True)
+            for name in ("vectors.bin", "scales.bin", "records.jsonl"):
+                open(self._file(name), "wb").close()
+            with open(self._file("meta.json"), "w") as f:  # Written last: marks the namespace as usable
+                json.dump({"dim": int(vectors.shape[1]), "dtype": "int8" if quantize else "float32"}, f)
+        self.refresh()
+
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        encoded, scales = self._encode(vectors)
+
+        # Existing ids are overwritten in place; new ones are appended
+        records = []
+        existing = [(i, self.ids[id_]) for i, id_ in enumerate(ids) if id_ in self.ids]
+        if existing:
+            stored = np.memmap(self._file("vectors.bin"), dtype=self.dtype, mode="r+", shape=(self.rows, self.dim))
+            for i, row in existing:
+                stored[row] = encoded[i]
+            stored.flush()
+            if scales is not None:
+                stored_scales = np.memmap(self._file("scales.bin"), dtype=np.float32, mode="r+", shape=(self.rows,))
+                for i, row in existing:
+                    stored_scales[row] = scales[i]
+                stored_scales.flush()
+            records += [(row, ids[i], metadatas[i]) for i, row in existing]
+
+        appended = [i for i, id_ in enumerate(ids) if id_ not in self.ids]
+        if appended:
+            with open(self._file("vectors.bin"), "ab") as f:
+                f.write(np.ascontiguousarray(encoded[appended]).tobytes())
+            if scales is not None:
+                with open(self._file("scales.bin"), "ab") as f:
+                    f.write(scales[appended].tobytes())
+            records += [(self.rows + n, ids[i], metadatas[i]) for n, i in enumerate(appended)]
+
+        with open(self._file("records.jsonl"), "a") as f:
+            f.writelines(json.dumps({"row": row, "id": id_, "metadata": metadata}) + "\n"
+                         for row, id_, metadata in records)
+        self.refresh()
+
+    def delete(self, ids: list[str]):
+        self.refresh()
+        rows = [self.ids[id_] for id_ in ids if id_ in self.ids]
+        if rows:
+            with open(self._file("records.jsonl"), "a") as f:
+                f.writelines(json.dumps({"row": row, "deleted": True}) + "\n" for row in rows)
+        self.refresh()
+
+    def search(self, queries: np.ndarray, k: int) -> list[list[tuple[Document, float]]]:
+        """Exact top-k by cosine similarity for a batch of query vectors."""
+        self.refresh()
+        if not self.rows or not self.live.any():
+            return [[] for _ in queries]
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        if self.dtype == np.int8:
+            scores = (queries @ np.asarray(self.vectors, dtype=np.float32).T) * self.scales
+        else:
+            scores = queries @ np.asarray(self.vectors).T
+        scores[:, ~self.live] = -np.inf
+
+        k = min(k, int(self.live.sum()))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for query_scores, candidates in zip(scores, top):
+            ordered = candidates[np.argsort(-query_scores[candidates])]
+            results.append([
+                (_to_document({key: value for key, value in self.metadatas[row].items() if key != "id"}),
+                 float(query_scores[row]))
+                for row in ordered
+            ])
+        return results
+
+
+class LocalStore(VectorStore):
+    """
+    In-process exact search over per-document matrices persisted under `root`.
+    Per-document indexes are small, so brute-force NumPy search beats a network
+    round trip and works fully offline. Namespaces are loaded lazily and reloaded
+    when another process has written to them.
+    """
+
+    def __init__(self, root: str = LOCAL_INDEX_DIR, quantize: bool = LOCAL_INDEX_QUANTIZE):
+        self.root = root
+        self.quantize = quantize
+        self._namespaces: dict[str, _LocalNamespace] = {}
+        self._lock = threading.RLock()
+        os.makedirs(root, exist_ok=True)
+
+    def _namespace(self, namespace: str) -> _LocalNamespace:
+        if not re.fullmatch(r"[A-Za-z0-9_.-]{1,128}", namespace):
+            namespace = hashlib.sha256(namespace.encode("utf-8")).hexdigest()
+        if namespace not in self._namespaces:
+            self._namespaces[namespace] = _LocalNamespace(os.path.join(self.root, namespace))
+        return self._namespaces[namespace]
+
+    def upsert(self, namespace, ids, vectors, metadatas):
+        if not ids:
+            return
+        with self._lock:
+            self._namespace(namespace).upsert(ids, np.asarray(vectors, dtype=np.float32), metadatas, self.quantize)
+
+    def query(self, namespace, vector, k):
+        return self.query_many(namespace, [vector], k)[0]
+
+    def query_many(self, namespace, vectors, k):
+        if len(vectors) == 0:
+            return []
+        with self._lock:
+            return self._namespace(namespace).search(np.asarray(vectors, dtype=np.float32), k)
+
+    def delete(self, namespace, ids):
+        with self._lock:
+            self._namespace(namespace).delete(ids)
+
+    def delete_namespace(self, namespace):
+        with self._lock:
+            ns = self._namespace(namespace)
+            if ns.exists():
+                for name in os.listdir(ns.path):
+                    os.remove(os.path.join(ns.path, name))
+                os.rmdir(ns.path)
+            ns.refresh()
+
+
+# --- LangChain Adapter ---
+
+class LangChainStore(VectorStore):
+    """
+    Adapts LangChain vector stores (Milvus, PGVector, ...) to this interface.
+    `factory(namespace)` returns the LangChain store holding that namespace,
+    typically one collection per namespace.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def _store(self, namespace: str):
+        with self._lock:
+            if namespace not in self._stores:
+                self._stores[namespace] = self.factory(namespace)
+            return self._stores[namespace]
+
+    def upsert(self, namespace, ids, vectors, metadatas):
+        texts = [metadata.get(TEXT_KEY, "") for metadata in metadatas]
+        metadatas = [{key: value for key, value in metadata.items() if key != TEXT_KEY} for metadata in metadatas]
+        self._store(namespace).add_embeddings(
+            texts=texts, embeddings=[list(map(float, vector)) for vector in vectors], metadatas=metadatas, ids=ids
+        )
+
+    def query(self, namespace, vector, k):
+        return self._store(namespace).similarity_search_with_score_by_vector(list(map(float, vector)), k=k)
+
+    def delete(self, namespace, ids):
+        self._store(namespace).delete(ids=ids)
+
+    def delete_namespace(self, namespace):
+        store = self._store(namespace)
+        if not hasattr(store, "delete_collection"):
+            raise NotImplementedError(f"{type(store).__name__} cannot drop a whole namespace")
+        store.delete_collection()
+        with self._lock:
+            self._stores.pop(namespace, None)
+
+
+# --- Factory ---
+
+def milvus_collection_name(namespace: str) -> str:
+    """
+    Maps a namespace to a valid Milvus collection name (a letter or underscore, then letters,
+    digits and underscores); content hashes often start with a digit and may carry a "-suffix".
+    """
+    if re.fullmatch(r"[A-Za-z_]\w{0,254}", namespace, flags=re.ASCII):
+        return namespace
+    name = "doc_" + re.sub(r"\W", "_", namespace, flags=re.ASCII)
+    return name if len(name) <= 255 else "doc_" + hashlib.sha256(namespace.encode("utf-8")).hexdigest()
+
+
+def create_vector_store(backend: str = VECTOR_BACKEND, **options) -> VectorStore:
+    """
+    Builds the configured backend.
+      "pinecone"  needs `index` (a pinecone Index)
+      "local"     accepts `root` and `quantize`
+      "milvus"    needs `embeddings` and `connection_args`; one collection per namespace (see milvus_collection_name)
+      "pgvector"  needs `embeddings` and `connection`; one collection per namespace
+    """
+    if backend == "pinecone":
+        return PineconeStore(options["index"])
+    if backend == "local":
+        return LocalStore(root=options.get("root", LOCAL_INDEX_DIR), quantize=options.get("quantize", LOCAL_INDEX_QUANTIZE))
+    if backend == "milvus":
+        from langchain_milvus.vectorstores import Milvus
+
+        return LangChainStore(lambda namespace: Milvus(
+            embeddings=options["embeddings"], collection_name=milvus_collection_name(namespace),
+            connection_args=options["connection_args"],
+        ))
+    if backend == "pgvector":
+        from langchain_postgres.vectorstores import PGVector
+
+        return LangChainStore(lambda namespace: PGVector(
+            embeddings=options["embeddings"], collection_name=namespace, connection=options["connection"],
+        ))
+    raise ValueError(f"Unknown vector store backend: {backend}")